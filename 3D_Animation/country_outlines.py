@@ -0,0 +1,80 @@
+import cartopy.io.shapereader as shpreader
+from shapely import geometry
+import numpy as np
+import json
+import os
+
+"""
+Country outlines for the 3D animation. All polygons of the countries in "interesting" (every island and exclave, and
+the borders of holes) are read from the shape file once, clipped to the data region and stored as a single (N, 3)
+array of lon, lat, altitude (zero) with rows of NaN between the separate lines. The array is saved to outline_file,
+so later runs only load it, and the whole basemap is added to the axes with one plot call.
+"""
+
+# the countries that are (partially) in the area for which we have data, shared with the Country Group
+country_list_file = "../Country Group/countries.json"
+interesting = list(json.load(open(country_list_file)))
+
+# data from 2016 for 1:20 million scale world map. More coarse or detailed maps are available. The coordinate
+# system is with longitude and latitude in degrees
+shape_file = 'Shapefiles/CNTR_RG_20M_2016_4326.shp'
+
+outline_file = "country_outlines.npy"
+
+# the geographic area for which we have data
+frame = geometry.box(-30, 30, 50, 70)
+
+
+# all rings (exterior and holes) of a polygon as line strings
+def polygon_rings(polygon):
+    return [geometry.LineString(polygon.exterior.coords)] + \
+           [geometry.LineString(ring.coords) for ring in polygon.interiors]
+
+
+# the parts of a line that lie inside the data frame, as a list of coordinate arrays
+def clip_line(line):
+    inside = line.intersection(frame)
+    if inside.is_empty:
+        return []
+    if hasattr(inside, "geoms"):  # the line may be cut into several pieces
+        return [np.array(part.coords) for part in inside.geoms if isinstance(part, geometry.LineString)]
+    if isinstance(inside, geometry.LineString):
+        return [np.array(inside.coords)]
+    return []
+
+
+# read the shape file and create the outline array for all interesting countries
+def create_outlines():
+    reader = shpreader.Reader(shape_file)
+
+    lines = []
+    for country in reader.records():
+        # the .split( ) part is necessary because the names have \x00\x00\x00... added to them
+        country_name = country.attributes['NAME_ENGL'].split("\x00")[0]
+        if country_name in interesting:
+            shape = country.geometry
+            polygons = shape.geoms if hasattr(shape, "geoms") else [shape]
+            for polygon in polygons:
+                for ring in polygon_rings(polygon):
+                    lines.extend(clip_line(ring))
+
+    # put all lines in one array, separated by a row of NaN so they are not connected to each other when plotted
+    separator = np.full((1, 2), np.nan)
+    outline = np.concatenate([part for line in lines for part in (line[:, :2], separator)])
+    return np.column_stack((outline, np.zeros(len(outline))))
+
+
+# load the outline array, creating it first if it does not exist or is older than the shape file or the country list
+def load_outlines():
+    sources = [shape_file, country_list_file]
+    if not os.path.exists(outline_file) or \
+            os.path.getmtime(outline_file) < max(os.path.getmtime(source) for source in sources):
+        np.save(outline_file, create_outlines())
+    return np.load(outline_file)
+
+
+# add all country outlines to a 3D axes in a single call
+def plot_outlines(ax, outline, **kwargs):
+    kwargs.setdefault("color", "black")
+    kwargs.setdefault("linewidth", 0.5)
+    return ax.plot(outline[:, 0], outline[:, 1], outline[:, 2], **kwargs)
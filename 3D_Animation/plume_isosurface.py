@@ -0,0 +1,154 @@
+import matplotlib.animation as animation
+import xarray as xr
+import numpy as np
+from matplotlib import pyplot as plt
+from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+from skimage.measure import marching_cubes
+import os
+from plume_points import eta_to_altitude_arr, delta_chunk, percentile_threshold, chunk_size
+
+"""
+Isosurfaces of the aviation plume. For every time step the surfaces where the delta concentration (ON - OFF) equals
+one of the iso-levels are extracted from the (altitude, lat, lon) volume with marching cubes. The vertices are placed
+at the real altitudes of the model levels, so the surfaces are not stretched like they would be on the level index.
+
+The meshes are decimated by merging all vertices that lie in the same cell of a coarse grid, and then cached in a
+single .npz file. Replaying the sequence only reads the cached meshes, the extraction is run again only if the source
+files or the iso-levels change.
+"""
+
+file_on = "Soot.24h.JUL.ON.nc4"
+file_off = "Soot.24h.JUL.OFF.nc4"
+mesh_file = "plume_JUL.iso.npz"
+
+# iso-levels of the delta concentration. If iso_levels is None, they are set to these percentiles of the delta over
+# the whole month instead
+iso_levels = None
+iso_percentiles = [99.0, 99.9]
+
+# cell size used for decimation, in longitude, latitude (degrees) and altitude (km). None keeps the full mesh
+decimation_cell = np.array([1.0, 0.8, 0.4])
+
+colours = ["tab:orange", "tab:red", "tab:purple"]
+fps = 5
+
+
+# merge all vertices that lie in the same cell of size cell into their mean position, and remove the triangles that
+# collapse to a line or point in the process
+def decimate(verts, faces, cell):
+    keys = np.floor(verts / cell).astype(np.int64)
+    _, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+
+    merged = np.empty((len(counts), 3))
+    for i in range(3):
+        merged[:, i] = np.bincount(inverse, weights=verts[:, i]) / counts
+
+    faces = inverse[faces]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    return merged.astype(np.float32), faces[keep].astype(np.int32)
+
+
+# extract the isosurface at one level from a (lev, lat, lon) volume. Returns vertices in (lon, lat, altitude) and the
+# triangles as indices into the vertices
+def isosurface(volume, level, lon, lat, altitude):
+    if not volume.min() < level < volume.max():
+        return np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.int32)
+
+    verts, faces, _, _ = marching_cubes(volume, level)
+
+    # marching cubes works in index space: convert to coordinates, using the level altitudes for the vertical
+    index = np.arange(len(altitude))
+    coords = np.empty_like(verts)
+    coords[:, 0] = np.interp(verts[:, 2], np.arange(len(lon)), lon)
+    coords[:, 1] = np.interp(verts[:, 1], np.arange(len(lat)), lat)
+    coords[:, 2] = np.interp(verts[:, 0], index, altitude)
+
+    if decimation_cell is not None:
+        return decimate(coords, faces, decimation_cell)
+    return coords.astype(np.float32), faces.astype(np.int32)
+
+
+# compute the meshes of all time steps and iso-levels and write them to the cache file
+def build_meshes(file_on, file_off, filename=mesh_file, variable="AerMassBC"):
+    da_on = xr.open_dataset(file_on)[variable]
+    da_off = xr.open_dataset(file_off)[variable]
+
+    levels = iso_levels
+    if levels is None:
+        levels = percentile_threshold(da_on, da_off, iso_percentiles)  # one pass for all iso-levels
+
+    altitude = eta_to_altitude_arr(da_on.lev.values)
+    lon = da_on.lon.values
+    lat = da_on.lat.values
+
+    meshes = {}
+    for start in range(0, da_on.time.size, chunk_size):
+        da = delta_chunk(da_on, da_off, start, start + chunk_size)
+        for t in range(len(da)):
+            for i, level in enumerate(levels):
+                verts, faces = isosurface(da[t], level, lon, lat, altitude)
+                meshes["verts_{}_{}".format(start + t, i)] = verts
+                meshes["faces_{}_{}".format(start + t, i)] = faces
+
+    np.savez_compressed(filename, levels=np.array(levels), time=da_on.time.values,
+                        settings=np.array(iso_settings()), **meshes)
+
+
+# the settings a cache file was made with, to check if it is still valid
+def iso_settings():
+    return [str(iso_levels), str(iso_percentiles), str(decimation_cell)]
+
+
+# load the cached meshes, building them first if the cache is missing, older than the source files or was made with
+# other settings. Returns a dictionary with the iso-levels, the times and the meshes
+def load_meshes(file_on, file_off, filename=mesh_file):
+    valid = os.path.exists(filename) and os.path.getmtime(filename) > max(os.path.getmtime(file_on),
+                                                                            os.path.getmtime(file_off))
+    if valid:
+        with np.load(filename) as data:
+            valid = list(data["settings"]) == iso_settings()
+    if not valid:
+        print("Extracting isosurfaces...")
+        build_meshes(file_on, file_off, filename)
+
+    with np.load(filename) as data:
+        return {name: data[name] for name in data.files}
+
+
+# the triangles of one mesh as an (n, 3, 3) array, the format used by Poly3DCollection
+def mesh_triangles(meshes, frame, i):
+    return meshes["verts_{}_{}".format(frame, i)][meshes["faces_{}_{}".format(frame, i)]]
+
+
+# replay the cached isosurfaces. Only the vertices of the collections are replaced in each frame
+def animate_isosurfaces(meshes):
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection='3d')
+    ax.set_xlim(-30, 50)
+    ax.set_ylim(30, 70)
+    ax.set_zlim(0, 15)
+    ax.set_xlabel("Longitude")
+    ax.set_ylabel("Latitude")
+    ax.set_zlabel("Altitude")
+
+    surfaces = []
+    for i in range(len(meshes["levels"])):
+        surface = Poly3DCollection(mesh_triangles(meshes, 0, i), alpha=0.3, facecolor=colours[i % len(colours)],
+                                   linewidth=0)
+        ax.add_collection3d(surface)
+        surfaces.append(surface)
+
+    def update(frame):
+        for i, surface in enumerate(surfaces):
+            surface.set_verts(mesh_triangles(meshes, frame, i))
+        ax.set_title("Time = " + str(meshes["time"][frame])[:10])
+        return surfaces
+
+    ani = animation.FuncAnimation(fig, update, len(meshes["time"]), interval=1000 / fps)
+    plt.show()
+    return ani
+
+
+if __name__ == "__main__":
+    animate_isosurfaces(load_meshes(file_on, file_off))
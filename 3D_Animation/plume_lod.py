@@ -0,0 +1,119 @@
+import numpy as np
+import os
+from plume_points import load_points, frame_points, cloud_filenames
+
+"""
+Level of detail for the 3D plume animation. For every time step the plume points are binned into voxel grids that
+become twice as coarse in every direction from one level to the next. All points in a voxel are replaced by a single
+point at their concentration-weighted mean position, with
+
+    - the summed concentration, which sets the marker size
+    - the mean concentration, which sets the colour
+
+Level 0 contains the original points. The pyramid of all levels is computed once for every time step and stored next
+to the point cloud, so the animation only has to pick the finest level that stays below max_points for each frame.
+This keeps the number of drawn markers (and the frame rate) constant for any threshold or grid resolution.
+"""
+
+lod_columns = ["lon", "lat", "altitude", "size", "colour"]
+
+# voxel size of level 1 in longitude, latitude (degrees) and altitude (km). Each following level doubles it
+base_voxel = np.array([1.25, 1.0, 0.5])
+n_levels = 6
+
+max_points = 5000  # maximum number of markers drawn in one frame
+
+
+def lod_filename(cloud_name):
+    return cloud_name + ".lod.npz"
+
+
+# merge the points (N x 5 plume points, see plume_points.columns) that fall in the same voxel of the given size.
+# Returns an array with one row per occupied voxel and the columns in lod_columns
+def merge_voxels(points, voxel):
+    position = points[:, 1:4].astype(np.float64)
+    value = points[:, 4].astype(np.float64)
+    weight = np.maximum(value, 0)
+
+    keys = np.floor(position / voxel).astype(np.int64)
+    _, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+
+    total = np.bincount(inverse, weights=weight)
+    safe_total = np.where(total > 0, total, 1)
+    merged = np.empty((len(counts), len(lod_columns)), dtype=np.float32)
+    for i in range(3):
+        merged[:, i] = np.bincount(inverse, weights=position[:, i] * weight) / safe_total
+        # voxels without any positive weight are placed at their plain mean position
+        plain = np.bincount(inverse, weights=position[:, i]) / counts
+        merged[:, i] = np.where(total > 0, merged[:, i], plain)
+    merged[:, 3] = np.bincount(inverse, weights=value)
+    merged[:, 4] = merged[:, 3] / counts
+    return merged
+
+
+# the original points of a frame in the LOD format. Each point is a voxel on its own
+def single_points(points):
+    merged = np.empty((len(points), len(lod_columns)), dtype=np.float32)
+    merged[:, :3] = points[:, 1:4]
+    merged[:, 3] = points[:, 4]
+    merged[:, 4] = points[:, 4]
+    return merged
+
+
+# build the pyramid for all time steps of a point cloud and save it. Each level is stored as one array with the
+# points of all frames and an array with the offsets of every frame, like the point cloud itself
+def build_pyramid(cloud_name):
+    points, offsets, times = load_points(cloud_name)
+    levels = [[] for _ in range(n_levels + 1)]
+    for frame in range(len(times)):
+        day = np.asarray(frame_points(points, offsets, frame))
+        levels[0].append(single_points(day))
+        for k in range(1, n_levels + 1):
+            levels[k].append(merge_voxels(day, base_voxel * 2 ** (k - 1)))
+
+    pyramid = {}
+    for k, frames in enumerate(levels):
+        pyramid["level" + str(k)] = np.concatenate(frames)
+        pyramid["offsets" + str(k)] = np.concatenate(([0], np.cumsum([len(frame) for frame in frames])))
+    np.savez(lod_filename(cloud_name), **pyramid)
+
+
+# load the pyramid of a point cloud, building it first if it is missing or older than the point cloud
+def load_pyramid(cloud_name):
+    filename = lod_filename(cloud_name)
+    point_file, index_file = cloud_filenames(cloud_name)
+    if not os.path.exists(filename) or os.path.getmtime(filename) < os.path.getmtime(index_file):
+        build_pyramid(cloud_name)
+    with np.load(filename) as data:
+        return {name: data[name] for name in data.files}
+
+
+# the points to draw for a frame: the finest level with at most max_points voxels. If even the coarsest level has
+# more, only the max_points voxels with the highest summed concentration are kept
+def frame_lod(pyramid, frame, cap=max_points):
+    for k in range(n_levels + 1):
+        offsets = pyramid["offsets" + str(k)]
+        if offsets[frame + 1] - offsets[frame] <= cap:
+            break
+    merged = pyramid["level" + str(k)][offsets[frame]:offsets[frame + 1]]
+    if len(merged) > cap:
+        merged = merged[np.argsort(merged[:, 3])[-cap:]]
+    return merged
+
+
+# the points to draw for frame i when sub_frames interpolated frames are shown between two time steps. The two
+# neighbouring time steps are cross-faded: the markers of the earlier one shrink while those of the later one grow,
+# so the plume moves smoothly without reading anything else than the two time steps
+def blended_lod(pyramid, i, sub_frames, cap=max_points):
+    k, j = divmod(i, sub_frames + 1)
+    f = j / (sub_frames + 1)
+    a = frame_lod(pyramid, k, cap)
+    if f == 0 or k + 1 >= len(pyramid["offsets0"]) - 1:
+        return a
+
+    b = frame_lod(pyramid, k + 1, cap)
+    blended = np.concatenate((a, b))
+    blended[:len(a), 3] *= 1 - f
+    blended[len(a):, 3] *= f
+    return blended
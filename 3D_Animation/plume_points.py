@@ -0,0 +1,148 @@
+import xarray as xr
+import numpy as np
+import os
+from quantile_sketch import new_sketch, sketch_add, sketch_quantile
+
+"""
+Extraction of the aviation plume as a sparse point cloud. The ON and OFF files are opened once and read in chunks of
+a few time steps. For every chunk the delta (ON - OFF) is computed and all voxels above the threshold are found at
+once for all time steps of the chunk. The points are appended to a binary file with the columns
+
+    time index, longitude, latitude, altitude (km), delta concentration
+
+and a small .npz file stores the offsets of each time step in the point file, the time values and the thresholds. The
+animation memory-maps the point file, so a frame is a slice points[offsets[t]:offsets[t + 1]] that is read from disk
+only when it is drawn.
+
+The threshold is either a percentile of the delta over the whole month (estimated with a streaming quantile sketch,
+see quantile_sketch.py) or a multiple of the mean delta of each time step.
+"""
+
+columns = ["time", "lon", "lat", "altitude", "value"]
+
+chunk_size = 4  # number of time steps that are read and processed together
+
+# points are kept if the delta is in the top percentage given by threshold_percentile (e.g. 99.9 keeps the highest
+# 0.1 % of all voxels of the month). The same threshold is then used for every day, and the number of points is known
+# in advance. Set it to None to use threshold_factor times the mean delta of each time step instead
+threshold_percentile = 99.9
+threshold_factor = 10
+
+
+# Convert eta levels to altitude
+def eta_to_altitude_arr(eta_array):
+    # data
+    alt_dat = np.genfromtxt("Altitude_levels.txt", skip_header=3, usecols=(1, 2))
+
+    # Grid points
+    grid = alt_dat[:, 0]
+
+    # Function values at grid points
+    func = alt_dat[:, 1]
+    return np.interp(eta_array, grid, func)
+
+
+# names of the point file and its index file for a given base name
+def cloud_filenames(cloud_name):
+    return cloud_name + ".points.f32", cloud_name + ".index.npz"
+
+
+# the delta (ON - OFF) for a chunk of time steps, as float32
+def delta_chunk(da_on, da_off, start, stop):
+    return da_on[start:stop].values.astype(np.float32) - da_off[start:stop].values.astype(np.float32)
+
+
+# find the delta value above which the highest (100 - percentile) % of all voxels lie. The data is streamed in chunks
+# of time steps into a quantile sketch, so the 4D array is never loaded as a whole. With a list of percentiles the
+# pair is still read once, and a list of thresholds is returned
+def percentile_threshold(da_on, da_off, percentile):
+    sketch = new_sketch()
+    for start in range(0, da_on.time.size, chunk_size):
+        da = delta_chunk(da_on, da_off, start, start + chunk_size)
+        for lev in range(da.shape[1]):
+            sketch_add(sketch, da[:, lev])
+    thresholds = sketch_quantile(sketch, np.asarray(percentile) / 100)
+    return float(thresholds) if np.ndim(percentile) == 0 else thresholds.tolist()
+
+
+# stream the ON/OFF pair and write all voxels above the threshold to the point cloud files. With a percentile
+# threshold the pair is read twice: once for the quantile sketch and once for the extraction
+def extract_points(file_on, file_off, cloud_name, variable="AerMassBC"):
+    da_on = xr.open_dataset(file_on)[variable]
+    da_off = xr.open_dataset(file_off)[variable]
+
+    # coordinates only have to be looked up once: the altitude of every level, and the lat/lon of every cell
+    altitude = eta_to_altitude_arr(da_on.lev.values).astype(np.float32)
+    lat = da_on.lat.values.astype(np.float32)
+    lon = da_on.lon.values.astype(np.float32)
+    n_time = da_on.time.size
+
+    point_file, index_file = cloud_filenames(cloud_name)
+    counts = np.zeros(n_time, dtype=np.int64)
+    thresholds = np.zeros(n_time)
+
+    if threshold_percentile is not None:
+        thresholds[:] = percentile_threshold(da_on, da_off, threshold_percentile)
+
+    with open(point_file, "wb") as outfile:
+        for start in range(0, n_time, chunk_size):
+            stop = min(start + chunk_size, n_time)
+
+            # Filtering out non-aviation data, for all time steps of the chunk at once
+            da = delta_chunk(da_on, da_off, start, stop)
+
+            # Threshold of every time step in the chunk
+            if threshold_percentile is None:
+                thresholds[start:stop] = np.mean(da, axis=(1, 2, 3)) * threshold_factor
+            thrs = thresholds[start:stop]
+
+            # Indices (time, lev, lat, lon) of all voxels that exceed the threshold of their time step
+            t, lev, la, lo = np.nonzero(da > thrs[:, np.newaxis, np.newaxis, np.newaxis])
+
+            points = np.empty((len(t), len(columns)), dtype=np.float32)
+            points[:, 0] = t + start
+            points[:, 1] = lon[lo]
+            points[:, 2] = lat[la]
+            points[:, 3] = altitude[lev]
+            points[:, 4] = da[t, lev, la, lo]
+            points.tofile(outfile)
+
+            counts[start:stop] = np.bincount(t, minlength=stop - start)
+
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    np.savez(index_file, offsets=offsets, time=da_on.time.values, thresholds=thresholds, variable=variable,
+             sources=np.array([file_on, file_off]), settings=threshold_settings())
+
+
+# the threshold settings a point cloud was made with, used to check whether it has to be extracted again
+def threshold_settings():
+    return np.array([np.nan if threshold_percentile is None else threshold_percentile, threshold_factor])
+
+
+# check whether the point cloud exists, is newer than both of its source files and used the current thresholds
+def cloud_is_valid(file_on, file_off, cloud_name):
+    point_file, index_file = cloud_filenames(cloud_name)
+    if not (os.path.exists(point_file) and os.path.exists(index_file)):
+        return False
+    created = min(os.path.getmtime(point_file), os.path.getmtime(index_file))
+    if created < os.path.getmtime(file_on) or created < os.path.getmtime(file_off):
+        return False
+    with np.load(index_file) as index:
+        return "settings" in index.files and np.array_equal(index["settings"], threshold_settings(), equal_nan=True)
+
+
+# memory-map the point cloud. Returns the points (N x 5, see columns), the offsets of every time step and the times
+def load_points(cloud_name):
+    point_file, index_file = cloud_filenames(cloud_name)
+    with np.load(index_file) as index:
+        offsets = index["offsets"]
+        times = index["time"]
+    if offsets[-1] == 0:  # an empty file can't be memory-mapped
+        return np.zeros((0, len(columns)), dtype=np.float32), offsets, times
+    points = np.memmap(point_file, dtype=np.float32, mode="r", shape=(int(offsets[-1]), len(columns)))
+    return points, offsets, times
+
+
+# the points of a single time step, as a view of the memory-mapped file
+def frame_points(points, offsets, frame):
+    return points[offsets[frame]:offsets[frame + 1]]
@@ -0,0 +1,92 @@
+import numpy as np
+import json
+
+"""
+Streaming quantile sketch with a fixed relative accuracy (the DDSketch algorithm). Values are counted in bins whose
+edges grow geometrically, so a quantile is always known to within a relative error alpha, no matter how many values
+have been added. Only the bin counts are kept, which makes it possible to feed the data in chunks (time steps,
+levels) without ever holding the whole 4D array, and two sketches can be merged by adding their counts (e.g. sketches
+of different files or of chunks that were processed separately).
+
+A sketch is a plain dictionary, so it can be written to and read from a JSON file.
+"""
+
+default_alpha = 0.01  # relative accuracy of the quantiles
+
+
+# create an empty sketch with relative accuracy alpha
+def new_sketch(alpha=default_alpha):
+    return {"alpha": alpha, "positive": {}, "negative": {}, "zero": 0, "count": 0}
+
+
+def _gamma(sketch):
+    return (1 + sketch["alpha"]) / (1 - sketch["alpha"])
+
+
+# add counts for the bins in which the (nonzero, positive) magnitudes fall to one of the stores of the sketch
+def _add_to_store(store, magnitudes, gamma):
+    bins, counts = np.unique(np.ceil(np.log(magnitudes) / np.log(gamma)).astype(np.int64), return_counts=True)
+    for b, c in zip(bins.tolist(), counts.tolist()):
+        store[b] = store.get(b, 0) + c
+
+
+# add an array of any shape to the sketch. NaN values are ignored
+def sketch_add(sketch, values):
+    values = np.asarray(values, dtype=np.float64).ravel()
+    values = values[~np.isnan(values)]
+    gamma = _gamma(sketch)
+
+    # values that are too small to get their own bin are counted as zero
+    tiny = np.abs(values) < 1E-300
+    _add_to_store(sketch["positive"], values[(values > 0) & ~tiny], gamma)
+    _add_to_store(sketch["negative"], -values[(values < 0) & ~tiny], gamma)
+    sketch["zero"] += int(np.count_nonzero(tiny))
+    sketch["count"] += len(values)
+    return sketch
+
+
+# combine two sketches with the same accuracy into a new one
+def sketch_merge(a, b):
+    if a["alpha"] != b["alpha"]:
+        raise ValueError("Only sketches with the same accuracy can be merged")
+    merged = new_sketch(a["alpha"])
+    for name in ("positive", "negative"):
+        for store in (a[name], b[name]):
+            for key, count in store.items():
+                merged[name][key] = merged[name].get(key, 0) + count
+    merged["zero"] = a["zero"] + b["zero"]
+    merged["count"] = a["count"] + b["count"]
+    return merged
+
+
+# estimate the quantiles q (between 0 and 1, scalar or array) of all values that were added
+def sketch_quantile(sketch, q):
+    if sketch["count"] == 0:
+        raise ValueError("The sketch is empty")
+    gamma = _gamma(sketch)
+
+    # all bins in increasing order of value: negative values with the largest magnitude first, then zero, then the
+    # positive values. The representative value of a bin is the centre of its edges gamma^(i-1) and gamma^i
+    neg_keys = sorted(sketch["negative"], reverse=True)
+    pos_keys = sorted(sketch["positive"])
+    centres = np.concatenate((-2 * gamma ** np.array(neg_keys, dtype=np.float64) / (gamma + 1), [0.0],
+                              2 * gamma ** np.array(pos_keys, dtype=np.float64) / (gamma + 1)))
+    counts = np.array([sketch["negative"][k] for k in neg_keys] + [sketch["zero"]] +
+                      [sketch["positive"][k] for k in pos_keys], dtype=np.float64)
+
+    rank = np.asarray(q, dtype=np.float64) * (sketch["count"] - 1)
+    return centres[np.searchsorted(np.cumsum(counts), rank, side="right")]
+
+
+def save_sketch(sketch, filename):
+    with open(filename, "w") as outfile:
+        json.dump(sketch, outfile)
+
+
+def load_sketch(filename):
+    with open(filename) as infile:
+        sketch = json.load(infile)
+    # JSON only has string keys
+    for name in ("positive", "negative"):
+        sketch[name] = {int(key): count for key, count in sketch[name].items()}
+    return sketch
@@ -0,0 +1,216 @@
+from collections import OrderedDict
+from shapely.geometry.polygon import orient
+import xarray as xr
+import numpy as np
+from matplotlib import pyplot as plt
+import json
+import sys
+import os
+
+from country_master import create_country_polygons, summer, poll_on_filename, poll_off_filename
+sys.path.append("../Wind Group")
+from wind_cube import load_cube
+
+"""
+Computes how much aviation-attributable BC is transported into and out of each country. The horizontal transport flux
+is the delta concentration (aircraft ON minus OFF) multiplied by the wind (U, V) in the same grid cell, level and time.
+This flux is integrated along the borders of every country (clipped to the data region) and over the height of the
+model levels, which gives the net flow through the border in kg/s:
+    - positive values mean that BC leaves the country (export)
+    - negative values mean that BC enters the country (import)
+Inflow and outflow are also returned separately, since they can be much larger than the net value.
+
+The borders are split into pieces that each lie inside a single grid cell. For every piece the grid cell, its length
+and its outward normal are computed only once and stored in boundary_file. After that, the budget for a whole month
+is a single gather and sum over all pieces. The wind is read from the memory-mapped wind cubes of wind_cube.py (built
+from the MERRA2 files on the first run); it is 3-hourly, so it is averaged over each day to match the daily pollution
+data.
+"""
+
+level_file = '../Master program/Altitude_levels.txt'
+
+boundary_file = "boundary_segments.npz"  # precomputed border pieces
+output_file = "border_flux.json"
+
+# the model levels (indices) over which the flux is integrated
+flux_levels = slice(0, 72)
+
+earth_radius = 6.371E6  # m
+ug_to_kg = 1E-9  # AerMassBC is given in ug/m^3
+
+
+# split the edges of a ring at the grid cell boundaries. Returns the index of the grid cell of every piece, and the
+# outward normal of each piece multiplied by its length (in metres). The ring has to be oriented counter-clockwise for
+# exterior rings and clockwise for holes (see shapely.geometry.polygon.orient)
+def split_ring(coords, lon_edges, lat_edges):
+    cells, normals = [], []
+    coords = np.asarray(coords)
+    for (lon_a, lat_a), (lon_b, lat_b) in zip(coords[:-1], coords[1:]):
+        # fractions along the edge at which it crosses a cell boundary
+        crossings = [0.0, 1.0]
+        if lon_b != lon_a:
+            lines = lon_edges[(lon_edges > min(lon_a, lon_b)) & (lon_edges < max(lon_a, lon_b))]
+            crossings.extend((lines - lon_a) / (lon_b - lon_a))
+        if lat_b != lat_a:
+            lines = lat_edges[(lat_edges > min(lat_a, lat_b)) & (lat_edges < max(lat_a, lat_b))]
+            crossings.extend((lines - lat_a) / (lat_b - lat_a))
+        crossings = np.unique(crossings)
+
+        # the middle of each piece determines the grid cell it belongs to
+        middle = (crossings[:-1] + crossings[1:]) / 2
+        lon_mid = lon_a + middle * (lon_b - lon_a)
+        lat_mid = lat_a + middle * (lat_b - lat_a)
+        i_lon = np.searchsorted(lon_edges, lon_mid) - 1
+        i_lat = np.searchsorted(lat_edges, lat_mid) - 1
+
+        # length of each piece in metres, in eastward and northward direction
+        dx = np.radians(np.diff(crossings) * (lon_b - lon_a)) * earth_radius * np.cos(np.radians(lat_mid))
+        dy = np.radians(np.diff(crossings) * (lat_b - lat_a)) * earth_radius
+
+        inside = (i_lon >= 0) & (i_lon < len(lon_edges) - 1) & (i_lat >= 0) & (i_lat < len(lat_edges) - 1)
+        cells.append(np.stack((i_lat, i_lon), axis=1)[inside])
+        normals.append(np.stack((dy, -dx), axis=1)[inside])  # rotate the edge clockwise to get the outward normal
+
+    return np.concatenate(cells), np.concatenate(normals)
+
+
+# find all border pieces for the given countries on a grid with cell centres lon, lat. Returns a dictionary with the
+# country names, the country index, grid cell and normal of every piece. The pieces are sorted by country
+def boundary_segments(country_polygons, lon, lat):
+    lon_edges = np.concatenate(([lon[0] - (lon[1] - lon[0]) / 2], (lon[1:] + lon[:-1]) / 2,
+                                [lon[-1] + (lon[-1] - lon[-2]) / 2]))
+    lat_edges = np.concatenate(([lat[0] - (lat[1] - lat[0]) / 2], (lat[1:] + lat[:-1]) / 2,
+                                [lat[-1] + (lat[-1] - lat[-2]) / 2]))
+
+    names = list(country_polygons.keys())
+    country_index, cells, normals = [], [], []
+    for i, name in enumerate(names):
+        for region in country_polygons[name][0]:
+            region = orient(region, sign=1.0)  # exterior counter-clockwise, holes clockwise
+            for ring in [region.exterior] + list(region.interiors):
+                ring_cells, ring_normals = split_ring(ring.coords, lon_edges, lat_edges)
+                cells.append(ring_cells)
+                normals.append(ring_normals)
+                country_index.append(np.full(len(ring_cells), i))
+
+    cells = np.concatenate(cells)
+    return {"names": np.array(names), "country": np.concatenate(country_index), "lat_index": cells[:, 0],
+            "lon_index": cells[:, 1], "normal": np.concatenate(normals), "lon": lon, "lat": lat}
+
+
+# load the border pieces from boundary_file, or compute and save them if the file does not exist or was made for a
+# different grid or set of countries
+def load_boundary_segments(country_polygons, lon, lat):
+    if os.path.exists(boundary_file):
+        with np.load(boundary_file) as data:
+            segments = {name: data[name] for name in data.files}
+        if np.array_equal(segments["lon"], lon) and np.array_equal(segments["lat"], lat) and \
+                list(segments["names"]) == list(country_polygons.keys()):
+            return segments
+        print("Grid or countries in boundary file don't match, recalculating border pieces...")
+
+    segments = boundary_segments(country_polygons, lon, lat)
+    np.savez_compressed(boundary_file, **segments)
+    return segments
+
+
+# thickness (m) of the model levels with the given eta values, from the altitudes in the level table. The level edges
+# are assumed to lie halfway between the level midpoints, with the lowest edge at the ground
+def layer_thickness(eta):
+    alt_dat = np.genfromtxt(level_file, skip_header=3, usecols=(1, 2))
+    order = np.argsort(alt_dat[:, 0])
+    altitude = np.interp(eta, alt_dat[order, 0], alt_dat[order, 1]) * 1E3  # km to m
+
+    order = np.argsort(altitude)
+    sorted_alt = altitude[order]
+    edges = np.concatenate(([0], (sorted_alt[1:] + sorted_alt[:-1]) / 2,
+                            [sorted_alt[-1] + (sorted_alt[-1] - sorted_alt[-2]) / 2]))
+    thickness = np.empty_like(altitude)
+    thickness[order] = np.diff(edges)
+    return thickness
+
+
+# the wind cubes (see wind_cube.py) of the months of the given times, with all days of the times in them
+def wind_cubes(times):
+    dates = np.unique(np.asarray(times).astype("datetime64[D]"))
+    cubes = {}
+    for month in np.unique([str(date)[5:7] for date in dates]):
+        cubes[month] = load_cube(month, [str(date)[8:10] for date in dates if str(date)[5:7] == month])
+    return cubes
+
+
+# daily mean wind (U and V with shape (lev, lat, lon)) for the day of the given time, from the wind cubes
+def daily_wind(cubes, day):
+    day = np.datetime64(day, "D")
+    cube = cubes[str(day)[5:7]]
+    times = np.datetime64(cube["start"], "s") + cube["time"].astype("timedelta64[s]")
+    steps = np.flatnonzero(times.astype("datetime64[D]") == day)
+    return cube["U"][steps].mean(axis=0), cube["V"][steps].mean(axis=0)
+
+
+# compute the net flow, inflow and outflow (kg/s) through the borders of every country for every time step of the
+# delta concentration da_poll (time, lev, lat, lon). Returns an ordered dictionary "country_name: {"net": [...],
+# "inflow": [...], "outflow": [...]}" and the time steps
+def border_budget(country_polygons, da_poll):
+    segments = load_boundary_segments(country_polygons, da_poll.lon.values, da_poll.lat.values)
+    i_lat, i_lon = segments["lat_index"], segments["lon_index"]
+    normal = segments["normal"]
+    country = segments["country"]
+    n_countries = len(segments["names"])
+
+    da_poll = da_poll.isel(lev=flux_levels)
+    thickness = layer_thickness(da_poll.lev.values)
+    times = da_poll.time.values
+    cubes = wind_cubes(times)
+
+    net = np.zeros((len(times), n_countries))
+    inflow = np.zeros((len(times), n_countries))
+    outflow = np.zeros((len(times), n_countries))
+
+    for t, day in enumerate(times):
+        u, v = daily_wind(cubes, day)
+        u, v = u[flux_levels], v[flux_levels]
+        conc = da_poll.isel(time=t).values * ug_to_kg
+
+        # flux through each border piece, integrated over the height of the selected levels (kg/s)
+        transport = (u[:, i_lat, i_lon] * normal[:, 0] + v[:, i_lat, i_lon] * normal[:, 1]) * conc[:, i_lat, i_lon]
+        piece_flux = np.sum(transport * thickness[:, np.newaxis], axis=0)
+
+        net[t] = np.bincount(country, weights=piece_flux, minlength=n_countries)
+        outflow[t] = np.bincount(country, weights=np.maximum(piece_flux, 0), minlength=n_countries)
+        inflow[t] = np.bincount(country, weights=np.minimum(piece_flux, 0), minlength=n_countries)
+
+    budget = OrderedDict()
+    for i, name in enumerate(segments["names"]):
+        budget[str(name)] = {"net": net[:, i].tolist(), "inflow": inflow[:, i].tolist(),
+                             "outflow": outflow[:, i].tolist()}
+    return budget, times
+
+
+# plot the net flow, inflow and outflow of a few countries over time
+def plot_budget(budget, times, names):
+    fig, axes = plt.subplots(len(names), 1, sharex=True, squeeze=False)
+    for ax, name in zip(axes[:, 0], names):
+        ax.plot(times, budget[name]["outflow"], label="Outflow")
+        ax.plot(times, budget[name]["inflow"], label="Inflow")
+        ax.plot(times, budget[name]["net"], color="black", label="Net")
+        ax.set_title(name)
+        ax.set_ylabel("BC flow [kg/s]")
+    axes[0, 0].legend()
+    fig.autofmt_xdate()
+
+
+if __name__ == "__main__":
+    print("Creating country polygons...")
+    countries = create_country_polygons()
+
+    print("Computing border fluxes...")
+    DS_on = xr.open_dataset(poll_on_filename)
+    DS_off = xr.open_dataset(poll_off_filename)
+    budget, times = border_budget(countries, DS_on.AerMassBC - DS_off.AerMassBC)
+
+    with open(output_file, "w") as outfile:
+        json.dump({"summer": summer, "time": [str(t) for t in times], "budget": budget}, outfile, indent=4)
+
+    plot_budget(budget, times, ["Netherlands", "Germany", "France"])
+    plt.show()
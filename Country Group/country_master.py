@@ -8,6 +8,12 @@ from descartes import PolygonPatch
 from pprint import PrettyPrinter
 from pyproj import Geod, Transformer
 import json
+import sys
+
+sys.path.append("../Master program")
+from surface_cache import ground_level
+from delta_batch import delta_file
+from stage_trace import span, write_trace, print_trace
 
 """
 Shows map with colour coding for different statistics relating to aircraft emissions and ground pollution due to
@@ -67,6 +73,8 @@ METHOD_MEDIAN = "Median"
 
 method = METHOD_AVG
 
+trace_file = "country_master_trace.json"  # timing and memory of the stages of the last run (.json or .csv)
+
 country_file = json.load(open("countries.json"))
 
 # data from 2016 for 1:20 million scale world map. More coarse or detailed maps are available. The coordinate
@@ -184,15 +192,18 @@ def find_poll_em_data(country_polygons):
 
     # anything from here onwards is only executed in case the data needs to be recalculated
 
-    DS = xr.open_dataset(em_filename)
-    da_em = DS.BC * em_multiplier  # select only the BC (black carbon) emissions since it is inert
-
-    DS_on = xr.open_dataset(poll_on_filename)
-    DS_off = xr.open_dataset(poll_off_filename)
+    with span("Reading data files"):
+        DS = xr.open_dataset(em_filename)
+        da_em = DS.BC * em_multiplier  # select only the BC (black carbon) emissions since it is inert
 
-    # subtract pollution data without aircraft from pollution with aircraft to retrieve the pollution caused by
-    # aircraft only. Also, only select BC
-    da_poll = DS_on.AerMassBC - DS_off.AerMassBC
+        # subtract pollution data without aircraft from pollution with aircraft to retrieve the pollution caused by
+        # aircraft only, or use the precomputed difference if delta_batch.py has produced it. Also, only select BC at
+        # ground level, which is read from the surface cache instead of the full 72-level files
+        poll_delta_filename = delta_file(poll_on_filename, poll_off_filename)
+        if poll_delta_filename is not None:
+            da_poll = ground_level(poll_delta_filename, "AerMassBC")
+        else:
+            da_poll = ground_level(poll_on_filename, "AerMassBC") - ground_level(poll_off_filename, "AerMassBC")
 
     poll_em_data = {}
     lon_axis = da_em.coords['lon'].values  # the longitude values of the data grid
@@ -210,8 +221,7 @@ def find_poll_em_data(country_polygons):
                 # which are not explicitly specified (e.g. time or altitude)
                 poll_em_data[country][0].append(float(np.sum(da_em.sel(lon=lon, lat=lat)
                                                        .sel(lev=emission_levels).values)))  # select altitude range
-                poll_em_data[country][1].append(float(np.sum(da_poll.sel(lon=lon, lat=lat)
-                                                       .sel(lev=1, method='nearest').values)))
+                poll_em_data[country][1].append(float(np.sum(da_poll.sel(lon=lon, lat=lat).values)))
 
     # write the data into a buffer file, to speed up loading next time the program is run
     with open("poll_em_buffer.json", "w") as outfile:
@@ -418,44 +428,53 @@ def plot(country_polygons, processed_data, add_title="", add_info="", show_remov
     # ax.imshow(gradient, aspect='auto', cmap=plt.get_cmap(colormap))
 
 
-print("Creating country polygons...")
-countries = create_country_polygons()
-countries_with_data = countries.copy()  # the countries which can be used for analysis later on
-
-print("Retrieving raw pollution and emission data...")
-raw_data, unavailable = find_poll_em_data(countries)
-for country in unavailable:
-    del countries_with_data[country]
-
-print("Processing the data...")
-processed_data, removed_countries = process_data(countries, raw_data)
-for country in removed_countries:
-    del countries_with_data[country]
-
-print("Performing spatial analysis...")
-moran_global = morans_i_global(countries_with_data, processed_data)
-geary = gearys_c(countries_with_data, processed_data)
-moran_local = morans_i_local(countries_with_data, processed_data)
-
-print("Plotting the data...")
-plot(countries, processed_data, mapping=sqrt_mapping)
-
-print("Plotting the results of the spatial analysis...")
-plt.figure()
-plot(countries, moran_local, add_title=" (Local Moran's I)",
-     add_info="Global Moran's I: " + str(moran_global) + "\nGeary's C: " + str(geary))
-
-print("Finished.\n")
-
-pp = PrettyPrinter(indent=4)
-print("============= RESULTS ==============\n")
-
-print("These countries had no data available:", unavailable)
-print("These countries were removed:", removed_countries)
-print("Global Moran's I: ", moran_global)
-print("Geary's C: ", geary)
-print("Data:")
-pp.pprint(processed_data)
-print("Local Moran's I:")
-pp.pprint(moran_local)
-plt.show()
+if __name__ == "__main__":
+    with span("Creating country polygons"):
+        print("Creating country polygons...")
+        countries = create_country_polygons()
+        countries_with_data = countries.copy()  # the countries which can be used for analysis later on
+
+    with span("Retrieving raw pollution and emission data"):
+        print("Retrieving raw pollution and emission data...")
+        raw_data, unavailable = find_poll_em_data(countries)
+        for country in unavailable:
+            del countries_with_data[country]
+
+    with span("Processing the data"):
+        print("Processing the data...")
+        processed_data, removed_countries = process_data(countries, raw_data)
+        for country in removed_countries:
+            del countries_with_data[country]
+
+    with span("Performing spatial analysis"):
+        print("Performing spatial analysis...")
+        moran_global = morans_i_global(countries_with_data, processed_data)
+        geary = gearys_c(countries_with_data, processed_data)
+        moran_local = morans_i_local(countries_with_data, processed_data)
+
+    with span("Plotting the data"):
+        print("Plotting the data...")
+        plot(countries, processed_data, mapping=sqrt_mapping)
+
+        print("Plotting the results of the spatial analysis...")
+        plt.figure()
+        plot(countries, moran_local, add_title=" (Local Moran's I)",
+             add_info="Global Moran's I: " + str(moran_global) + "\nGeary's C: " + str(geary))
+
+    print("Finished.\n")
+    print_trace()
+    write_trace(trace_file)
+    print()
+
+    pp = PrettyPrinter(indent=4)
+    print("============= RESULTS ==============\n")
+
+    print("These countries had no data available:", unavailable)
+    print("These countries were removed:", removed_countries)
+    print("Global Moran's I: ", moran_global)
+    print("Geary's C: ", geary)
+    print("Data:")
+    pp.pprint(processed_data)
+    print("Local Moran's I:")
+    pp.pprint(moran_local)
+    plt.show()
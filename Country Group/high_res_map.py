@@ -2,6 +2,10 @@ from cartopy import crs
 import xarray as xr
 import numpy as np
 from matplotlib import pyplot as plt
+import sys
+
+sys.path.append("../Master program")
+from surface_cache import ground_level
 
 summer = True  # used to select between pollution data for January and July
 
@@ -14,9 +18,8 @@ poll_off_filename = "Soot.24h.{}.OFF.nc4".format("JUL" if summer else "JAN")
 
 em_filename = "AvEmFluxes.nc4"  # NetCDF file containing aircraft emissions
 
-poll_on_DS = xr.open_dataset(poll_on_filename)
-poll_off_DS = xr.open_dataset(poll_off_filename)
-poll_da = (poll_on_DS.AerMassBC - poll_off_DS.AerMassBC).sel(lev=1, method='nearest').sum(dim='time')
+# only the ground level is needed, which is read from the surface cache
+poll_da = (ground_level(poll_on_filename, "AerMassBC") - ground_level(poll_off_filename, "AerMassBC")).sum(dim='time')
 
 em_DS = xr.open_dataset(em_filename)
 em_da = em_DS.BC.sel(lev=emission_levels).sum(dim='lev')
@@ -5,6 +5,8 @@ import xarray as xr
 from tkinter import messagebox
 from Altitude_converter import eta_to_altitude, altitude_to_eta, levels_to_altitude, altitude_to_levels
 import numpy as np
+import os
+from catalog import load_catalog, file_entry, counterpart, file_variables
 
 def Select_pollutant():
     def open_file():
@@ -39,15 +41,24 @@ def Select_pollutant():
             subtracted_file = filedialog.askopenfilename(filetypes=(("netCDF files", "*.nc4"), ("all files", "*.*")))
 
             DS_sub = xr.open_dataset(subtracted_file)
+            b_sub.config(text=" OFF: " + os.path.basename(subtracted_file) + " (click to change)")
 
         b_sub = tk.Button(window, text=" Open File with aircraft OFF (optional)", command=open_subtracted)
         b_sub.grid(column=1, row=0)
 
-        # Make list with variables
-        varlst = []
-        for i in DS.variables:
-            if i not in ['lev', 'lon', 'lat', 'ilev', 'time']:
-                varlst.append(i)
+        # Select the file with aircraft OFF automatically if an ON file was chosen and the catalog knows the pair
+        entry = file_entry(catalog, filepath)
+        off_file = counterpart(catalog, filepath) if entry is not None and entry.get("switch") == "ON" else None
+        if off_file is not None and os.path.exists(off_file):
+            DS_sub = xr.open_dataset(off_file)
+            b_sub.config(text=" OFF: " + os.path.basename(off_file) + " (click to change)")
+
+        # Make list with variables, from the catalog if the file is in there
+        varlst = file_variables(catalog, filepath)
+        if not varlst:
+            for i in DS.variables:
+                if i not in ['lev', 'lon', 'lat', 'ilev', 'time']:
+                    varlst.append(i)
 
         options = varlst
 
@@ -186,6 +197,9 @@ def Select_pollutant():
 
 
 
+    # Catalog of the data files, used to find variables and ON/OFF pairs without opening the files
+    catalog = load_catalog()
+
     # Initialize window
     window = tk.Tk()
 
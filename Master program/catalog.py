@@ -0,0 +1,147 @@
+from netCDF4 import Dataset as netcdf_dataset
+import numpy as np
+import json
+import glob
+import os
+import re
+
+"""
+Catalog of the NetCDF files in the data directories. File names follow the convention
+
+    <species>.<freq>.<month>.<ON|OFF>.nc4        e.g. Soot.24h.JAN.ON.nc4, PM25.1h.JUL.OFF.nc4
+
+For every file the catalog stores the parsed name, size, modification time, variables (with dimensions, shape and
+type) and the range of every coordinate. The result is written to an index file, and a file is only opened again
+when its size or modification time changes. Files of the same species, frequency and month are paired automatically,
+so the OFF file belonging to an ON file (and the variables in it) can be found without opening any NetCDF file.
+Files that don't follow the convention (e.g. AvEmFluxes.nc4) are listed as well, but are not paired.
+"""
+
+data_dirs = ["../Data/"]
+index_file = "../Data/catalog.json"
+
+# DELTA and REL are the derived files written by delta_batch.py
+name_pattern = re.compile(r"^(?P<species>[^.]+)\.(?P<freq>[^.]+)\.(?P<month>[^.]+)"
+                          r"\.(?P<switch>ON|OFF|DELTA|REL)\.nc4$")
+
+
+# read the description of a single file
+def describe_file(path):
+    entry = {"path": os.path.abspath(path), "name": os.path.basename(path), "size": os.path.getsize(path),
+             "mtime": os.path.getmtime(path), "variables": {}, "coords": {}}
+
+    match = name_pattern.match(entry["name"])
+    if match:
+        entry.update(match.groupdict())
+
+    with netcdf_dataset(path) as ds:
+        for name, var in ds.variables.items():
+            if name in ds.dimensions or name in ('lev', 'ilev'):
+                values = var[:]
+                units = getattr(var, "units", "")
+                if name == "time" or not np.issubdtype(values.dtype, np.number):
+                    entry["coords"][name] = {"size": int(values.size), "first": float(values.flat[0]),
+                                             "last": float(values.flat[-1]), "units": units}
+                else:
+                    entry["coords"][name] = {"size": int(values.size), "min": float(np.min(values)),
+                                             "max": float(np.max(values)), "units": units}
+            else:
+                entry["variables"][name] = {"dims": list(var.dimensions), "shape": list(var.shape),
+                                            "dtype": str(var.dtype), "units": getattr(var, "units", "")}
+    return entry
+
+
+# scan the data directories and update the index file. Files that have not changed since the last scan are taken
+# from the existing index without opening them
+def scan(dirs=data_dirs, filename=index_file):
+    old = {}
+    if os.path.exists(filename):
+        with open(filename) as infile:
+            old = {entry["path"]: entry for entry in json.load(infile)["files"]}
+
+    files = []
+    for directory in dirs:
+        for path in sorted(glob.glob(os.path.join(directory, "*.nc4"))):
+            path = os.path.abspath(path)
+            entry = old.get(path)
+            if entry is None or entry["size"] != os.path.getsize(path) or entry["mtime"] != os.path.getmtime(path):
+                entry = describe_file(path)
+            files.append(entry)
+
+    catalog = {"files": files, "pairs": make_pairs(files)}
+    with open(filename, "w") as outfile:
+        json.dump(catalog, outfile, indent=4)
+    return catalog
+
+
+# group the files with the same species, frequency and month. Returns a list of {"species", "freq", "month", "ON",
+# "OFF", "DELTA", "REL"}, where a file is None if it is missing
+def make_pairs(files):
+    pairs = {}
+    for entry in files:
+        if "switch" not in entry:
+            continue
+        key = (entry["species"], entry["freq"], entry["month"])
+        pair = pairs.setdefault(key, {"species": key[0], "freq": key[1], "month": key[2], "ON": None, "OFF": None,
+                                      "DELTA": None, "REL": None})
+        pair[entry["switch"]] = entry["path"]
+    return [pairs[key] for key in sorted(pairs)]
+
+
+# load the catalog from the index file, scanning the directories only if there is no index file yet or if rescan is
+# set. Scanning is cheap when nothing has changed, so it can be done every time a program starts
+def load_catalog(rescan=True, dirs=data_dirs, filename=index_file):
+    if rescan or not os.path.exists(filename):
+        return scan(dirs, filename)
+    with open(filename) as infile:
+        return json.load(infile)
+
+
+# the catalog entry of a file, or None if it is not in the catalog
+def file_entry(catalog, path):
+    path = os.path.abspath(path)
+    for entry in catalog["files"]:
+        if entry["path"] == path:
+            return entry
+    return None
+
+
+# the complete ON/OFF pairs, optionally only for a species, frequency or month
+def complete_pairs(catalog, species=None, freq=None, month=None):
+    return [pair for pair in catalog["pairs"] if pair["ON"] and pair["OFF"] and
+            (species is None or pair["species"] == species) and (freq is None or pair["freq"] == freq) and
+            (month is None or pair["month"] == month)]
+
+
+# the ON and OFF file for a species, frequency and month, e.g. resolve_pair(catalog, "Soot", "24h", "JAN")
+def resolve_pair(catalog, species, freq, month):
+    pairs = complete_pairs(catalog, species, freq, month)
+    if not pairs:
+        raise FileNotFoundError("No ON/OFF pair found for " + ".".join((species, freq, month)))
+    return pairs[0]["ON"], pairs[0]["OFF"]
+
+
+# the file that belongs to the given file with aircraft switched the other way (the OFF file of an ON file and vice
+# versa), or None if there is none
+def counterpart(catalog, path):
+    entry = file_entry(catalog, path)
+    if entry is None or entry.get("switch") not in ("ON", "OFF"):
+        return None
+    other = "OFF" if entry["switch"] == "ON" else "ON"
+    for pair in catalog["pairs"]:
+        if pair[entry["switch"]] == entry["path"]:
+            return pair[other]
+    return None
+
+
+# names of the data variables of a file (everything that is not a coordinate)
+def file_variables(catalog, path):
+    entry = file_entry(catalog, path)
+    return [] if entry is None else list(entry["variables"].keys())
+
+
+if __name__ == "__main__":
+    catalog = scan()
+    for pair in catalog["pairs"]:
+        print("{species:>8} {freq:>4} {month}  ON: {ON}  OFF: {OFF}".format(**pair))
+    print(len(catalog["files"]), "files,", len(complete_pairs(catalog)), "complete pairs")
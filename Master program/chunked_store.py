@@ -0,0 +1,156 @@
+from netCDF4 import Dataset as netcdf_dataset
+import numpy as np
+import itertools
+import glob
+import os
+
+"""
+Converts the NetCDF inputs into compressed, chunked copies that are tuned for the two ways the data is read:
+
+    - "map" layout: one chunk holds a whole lat/lon map of a single time step and level. Used for plots of one time
+      and level (show_plot, animate_plot).
+    - "series" layout: one chunk holds all time steps (and levels, if there is no time) of a small block of grid
+      cells. Used for time series and columns of single cells, and for sums over levels.
+
+Both layouts are normal NetCDF4 files (zlib compressed) in store_dir, named <file>.map.nc4 and <file>.series.nc4.
+read_store() takes a selection per dimension, counts how many chunks each available layout would have to read for it
+and reads from the layout with the fewest chunks.
+"""
+
+data_dir = "../Data/"
+store_dir = "../Data/store/"
+
+horizontal = ("lat", "lon")
+series_block = 8  # number of grid cells in lat and lon direction per chunk in the series layout
+compression = 4  # zlib compression level
+
+layouts = ("map", "series")
+
+
+def store_filename(filename, layout):
+    return os.path.join(store_dir, os.path.basename(filename).replace(".nc4", "") + "." + layout + ".nc4")
+
+
+# chunk shape of a variable with the given dimensions and shape in a layout
+def chunk_shape(dims, shape, layout):
+    chunks = []
+    for dim, size in zip(dims, shape):
+        if layout == "map":
+            chunks.append(size if dim in horizontal else 1)
+        elif dim in horizontal:
+            chunks.append(min(series_block, size))
+        elif dim == "lev" and "time" in dims:
+            chunks.append(1)
+        else:
+            chunks.append(size)
+    return chunks
+
+
+# the blocks in which a variable is copied: each block is a tuple of slices that covers a whole number of output
+# chunks, but not more than one chunk along the dimensions that are chunked with size 1 or split horizontally
+def copy_blocks(dims, shape, chunks, layout):
+    ranges = []
+    for dim, size, chunk in zip(dims, shape, chunks):
+        if layout == "series" and dim == "lon":
+            ranges.append([slice(0, size)])  # whole rows, so the source is read in large contiguous pieces
+        else:
+            ranges.append([slice(start, min(start + chunk, size)) for start in range(0, size, chunk)])
+    return itertools.product(*ranges)
+
+
+# write one layout of a NetCDF file
+def convert_file(filename, layout):
+    os.makedirs(store_dir, exist_ok=True)
+    src = netcdf_dataset(filename)
+    dst = netcdf_dataset(store_filename(filename, layout), "w", format="NETCDF4")
+    dst.setncatts({name: src.getncattr(name) for name in src.ncattrs()})
+    for name, dim in src.dimensions.items():
+        dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+    for name, var in src.variables.items():
+        if var.ndim > 1:
+            chunks = chunk_shape(var.dimensions, var.shape, layout)
+            out = dst.createVariable(name, var.dtype, var.dimensions, zlib=True, complevel=compression,
+                                     chunksizes=chunks, fill_value=getattr(var, "_FillValue", None))
+        else:
+            out = dst.createVariable(name, var.dtype, var.dimensions)
+        out.setncatts({key: var.getncattr(key) for key in var.ncattrs() if key != "_FillValue"})
+
+        if var.ndim > 1:
+            for block in copy_blocks(var.dimensions, var.shape, chunks, layout):
+                out[block] = var[block]
+        else:
+            out[:] = var[:]
+
+    dst.close()
+    src.close()
+
+
+# check whether a layout of a file exists and is newer than the file itself
+def store_is_valid(filename, layout):
+    stored = store_filename(filename, layout)
+    return os.path.exists(stored) and os.path.getmtime(stored) > os.path.getmtime(filename)
+
+
+# convert all NetCDF files in a directory to the given layouts, skipping the ones that are up to date
+def convert_directory(directory=data_dir, which=layouts):
+    for filename in sorted(glob.glob(os.path.join(directory, "*.nc4"))):
+        for layout in which:
+            if not store_is_valid(filename, layout):
+                print("Converting", os.path.basename(filename), "to", layout, "layout...")
+                convert_file(filename, layout)
+
+
+# turn a selection (dictionary dimension name: index or slice) into a tuple of indices for a variable
+def selection_key(var, selection):
+    return tuple(selection.get(dim, slice(None)) for dim in var.dimensions)
+
+
+# number of chunks of a variable that are touched by a selection
+def chunks_touched(var, key):
+    chunking = var.chunking()
+    if chunking == "contiguous":
+        return 1
+    n = 1
+    for index, chunk, size in zip(key, chunking, var.shape):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(size)
+            n *= (max(stop - 1, start) // chunk) - (start // chunk) + 1
+        else:
+            index = np.atleast_1d(index) % size
+            n *= len(np.unique(index // chunk))
+    return n
+
+
+# the layout from which a selection can be read with the fewest chunks, among the layouts that are up to date. Returns
+# None if no layout is available
+def best_layout(filename, variable, selection):
+    best, best_chunks = None, None
+    for layout in layouts:
+        if not store_is_valid(filename, layout):
+            continue
+        with netcdf_dataset(store_filename(filename, layout)) as ds:
+            var = ds.variables[variable]
+            n = chunks_touched(var, selection_key(var, selection))
+        if best is None or n < best_chunks:
+            best, best_chunks = layout, n
+    return best
+
+
+# read a selection of a variable, e.g. read_store("PM25.1h.JAN.ON.nc4", "PM25", time=5) for a map or
+# read_store(..., lat=40, lon=62) for the time series of a cell (indices, not coordinate values). Uses the best
+# layout in the store, or the original file if it has not been converted
+def read_store(filename, variable, **selection):
+    layout = best_layout(filename, variable, selection)
+    path = filename if layout is None else store_filename(filename, layout)
+    with netcdf_dataset(path) as ds:
+        var = ds.variables[variable]
+        values = var[selection_key(var, selection)]
+    if np.ma.isMaskedArray(values) and values.dtype.kind == "f":
+        return values.filled(np.nan)
+    return np.asarray(values)
+
+
+if __name__ == "__main__":
+    convert_directory()
+    print("Finished")
@@ -0,0 +1,147 @@
+import numpy as np
+import xarray as xr
+from parallel_stats import block_plan, read_block, run_tasks, variable_info, processes
+
+"""
+Vertical integration of concentration fields with levels (e.g. AerMassBC of the Soot files) into column burdens: the
+total column and partial columns such as the boundary layer or the cruise band, all in one reduction over the levels.
+
+The weights are computed once from the level table (Altitude_levels.txt). The table has the pressure at the level
+midpoints, p = eta * surface_pressure; the edges lie halfway between two midpoints (at the ground and at the top they
+are extrapolated). Every level is weighted with its pressure thickness:
+    - mixing ratios (mol mol-1): dp / (g * M_air), the moles of air per m2, so the burden is in mol m-2
+    - mass concentrations (ug m-3): the thickness in m of the level, from the altitude of its edges (interpolated over
+      the table in log pressure), so the burden is in ug m-2
+A partial column between two altitudes takes the part of every level that lies between them (in pressure), so the
+partial columns add up to the total column.
+
+Missing values are not counted as zero: the burden of a column is scaled up by the part of its weight that had valid
+data, and that part is returned as the valid_fraction coordinate (1 for a complete column, NaN if nothing was valid),
+so a partial column can be told apart from a real low burden.
+
+The file is read in blocks of time steps (parallel_stats.block_plan), so month-long files are streamed through memory
+and the blocks are spread over processes. The weights of all columns form a matrix (column, lev) that is applied to a
+block with a single tensordot.
+"""
+
+level_file = "Altitude_levels.txt"
+surface_pressure = 1013.25  # hPa, the pressure at eta = 1
+gravity = 9.80665  # m/s2
+air_molar_mass = 28.9644E-3  # kg/mol, dry air
+columns = {"total": (0, np.inf), "boundary layer": (0, 1), "cruise": (9, 13)}  # altitude ranges in km
+
+
+# eta, altitude (km) and pressure (hPa) of the level midpoints from the ground up, with the ground added as the first
+# row (eta 1, altitude 0)
+def level_table():
+    table = np.genfromtxt(level_file, skip_header=3, usecols=(1, 2, 3))[::-1]
+    return np.vstack(([1, 0, surface_pressure], table)).T
+
+
+# pressure (hPa) at the midpoints of the levels of a lev coordinate: eta values, or level numbers (1 at the ground)
+def level_pressures(lev):
+    lev = np.atleast_1d(lev)
+    if np.issubdtype(lev.dtype, np.integer):
+        return level_table()[2][lev]
+    return lev * surface_pressure
+
+
+# pressure at the bottom and top edge of every level, from the midpoints (in any order)
+def pressure_edges(mid):
+    order = np.argsort(-mid)  # from the ground up
+    p = mid[order]
+    edges = np.concatenate(([1.5 * p[0] - 0.5 * p[1]], (p[1:] + p[:-1]) / 2, [max(1.5 * p[-1] - 0.5 * p[-2], 0)]))
+    bottom, top = np.empty(len(p)), np.empty(len(p))
+    bottom[order], top[order] = edges[:-1], edges[1:]
+    return bottom, top
+
+
+# altitude (km) at a pressure (hPa) and the other way around, linear in log pressure between the rows of the table
+def pressure_to_altitude(pressure):
+    _, altitude, table_pressure = level_table()
+    return np.interp(-np.log(np.maximum(pressure, 1E-12)), -np.log(table_pressure), altitude)
+
+
+def altitude_to_pressure(altitude):
+    _, table_altitude, table_pressure = level_table()
+    pressure = np.exp(np.interp(altitude, table_altitude, np.log(table_pressure), right=-np.inf))
+    return np.where(np.asarray(altitude) <= 0, np.inf, pressure)  # the ground includes all of the lowest level
+
+
+# weights (column, lev) that integrate a variable with the given units over the levels of a lev coordinate, and the
+# units of the result
+def column_weights(lev, units, columns=columns):
+    bottom, top = pressure_edges(level_pressures(lev))
+    if units.startswith("mol mol-1") or units in ("mol/mol", "v/v"):
+        layer = (bottom - top) * 100 / (gravity * air_molar_mass)
+        out_units = "mol m-2"
+    elif "m-3" in units or "/m3" in units:
+        layer = (pressure_to_altitude(top) - pressure_to_altitude(bottom)) * 1000
+        out_units = units.replace("m-3", "m-2").replace("/m3", "/m2")
+    else:
+        raise ValueError("Can't integrate a variable in " + units + ", only mixing ratios and mass concentrations")
+
+    weights = np.zeros((len(columns), len(bottom)))
+    for i, (low, high) in enumerate(columns.values()):
+        # part of every level between the pressures of the two altitudes
+        overlap = np.minimum(bottom, altitude_to_pressure(low)) - np.maximum(top, altitude_to_pressure(high))
+        weights[i] = np.clip(overlap / (bottom - top), 0, 1) * layer
+    return weights, out_units
+
+
+# the weighted sums of a block over the levels, and the weights of the levels with valid values
+def _integrate(args):
+    filename, variable, block, off_filename, dims, weights = args
+    values = read_block(filename, variable, block, off_filename)
+    valid = ~np.isnan(values)
+    block_weights = weights[:, block["lev"]]
+    axes = ([1], [dims.index("lev")])
+    return block, (np.tensordot(block_weights, np.where(valid, values, 0), axes=axes),
+                   np.tensordot(block_weights, valid.astype(np.float64), axes=axes))
+
+
+# column burdens of a variable (ON - OFF if off_filename is given), as a DataArray (column, time, lat, lon) with the
+# columns (name: altitude range in km) as the first dimension, and the fraction of the weight of every column that had
+# valid data as the coordinate valid_fraction
+def column_burden(filename, variable, columns=columns, off_filename=None, n_processes=processes):
+    dims, shape, coords = variable_info(filename, variable)
+    with xr.open_dataset(filename) as DS:
+        units = DS[variable].attrs.get("units", "")
+    weights, out_units = column_weights(coords["lev"], units, columns)
+
+    out_dims = [dim for dim in dims if dim != "lev"]
+    out = np.zeros([len(columns)] + [size for dim, size in zip(dims, shape) if dim != "lev"])
+    valid_weight = np.zeros_like(out)
+    tasks = [(filename, variable, block, off_filename, dims, weights)
+             for block in block_plan(dims, shape, n_processes=n_processes)]
+    for block, (block_columns, block_valid) in run_tasks(_integrate, tasks, n_processes):
+        index = (slice(None),) + tuple(block.get(dim, slice(None)) for dim in out_dims)
+        out[index] += block_columns
+        valid_weight[index] += block_valid
+
+    # scale every column up to its full weight, NaN where no level of the column had data
+    total_weight = weights.sum(axis=1).reshape((-1,) + (1,) * len(out_dims))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        valid_fraction = np.where(total_weight > 0, valid_weight / total_weight, np.nan)
+        out = np.where(valid_fraction > 0, out / valid_fraction, np.nan)
+
+    out_dims = ["column"] + out_dims
+    coords = dict({dim: coords[dim] for dim in out_dims if dim in coords}, column=list(columns),
+                  valid_fraction=(out_dims, valid_fraction))
+    return xr.DataArray(out, dims=out_dims, coords=coords, name=variable, attrs={"units": out_units})
+
+
+if __name__ == "__main__":
+    from matplotlib import pyplot as plt
+    import cartopy.crs as ccrs
+
+    on, off = "../Data/Soot.24h.JAN.ON.nc4", "../Data/Soot.24h.JAN.OFF.nc4"
+    burden = column_burden(on, "AerMassBC", off_filename=off).mean("time")
+
+    fig = plt.figure(figsize=(16, 6))
+    for i, name in enumerate(["total", "cruise"]):
+        ax = fig.add_subplot(1, 2, i + 1, projection=ccrs.PlateCarree())
+        ax.coastlines(resolution='50m')
+        burden.sel(column=name).plot(ax=ax, cmap="coolwarm", cbar_kwargs={"label": "BC [" + burden.units + "]"})
+        ax.set_title("Aviation BC, " + name + " column (January mean)")
+    plt.show()
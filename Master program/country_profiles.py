@@ -0,0 +1,90 @@
+import numpy as np
+import xarray as xr
+import os
+from parallel_stats import grouped_series, processes
+from point_query import countries
+from column_burden import level_pressures, pressure_to_altitude, columns
+
+"""
+Average vertical profiles of a variable above every country: the area-weighted mean over the grid cells of the country
+for every level and time step, as a cube (country, lev, time). With an OFF file the profiles are those of ON - OFF,
+the part that is caused by aviation.
+
+The cube is computed in one pass over the file (parallel_stats.grouped_series) and cached next to the data file
+(<file>.<variable>.profiles.nc, or <ON file>.minus.<OFF file>.<variable>.profiles.nc for ON - OFF). Countries that are
+not in the cache yet are added to it; the cache is recomputed when one of the data files has been modified. Plotting
+profiles only reads the cache, so it takes no time after the first run.
+
+The altitude of every level (km, from the level table) is stored with the cube, so profiles can be plotted against
+height.
+"""
+
+default_countries = ["Austria", "Belgium", "Czechia", "Denmark", "France", "Germany", "Ireland", "Italy",
+                     "Netherlands", "Norway", "Poland", "Portugal", "Spain", "Sweden", "Switzerland", "United Kingdom"]
+
+
+def profile_filename(filename, variable, off_filename=None):
+    if off_filename is None:
+        return filename + "." + variable + ".profiles.nc"
+    return filename + ".minus." + os.path.basename(off_filename) + "." + variable + ".profiles.nc"
+
+
+# compute the profiles (country, lev, time) of the given countries
+def compute_profiles(filename, variable, country_names, off_filename=None, n_processes=processes):
+    series = grouped_series(filename, variable, countries(country_names), off_filename, n_processes)
+    cube = series.rename(location="country").transpose("country", "lev", ...)
+    cube = cube.assign_coords(altitude=("lev", pressure_to_altitude(level_pressures(cube.lev.values))))
+    with xr.open_dataset(filename) as DS:
+        cube.attrs["units"] = DS[variable].attrs.get("units", "")
+    return cube
+
+
+# the profiles (country, lev, time) of a variable, from the cache if it is up to date and has all countries
+def load_profiles(filename, variable, country_names=default_countries, off_filename=None, n_processes=processes):
+    country_names = list(country_names)
+    cache = profile_filename(filename, variable, off_filename)
+    sources = [filename] if off_filename is None else [filename, off_filename]
+    mtimes = [os.path.getmtime(source) for source in sources]
+
+    cube = None
+    if os.path.exists(cache):
+        with xr.open_dataset(cache) as DS:
+            if list(np.atleast_1d(DS.attrs.get("mtimes"))) == mtimes:
+                cube = DS[variable].load()
+
+    missing = country_names if cube is None else [name for name in country_names if name not in cube.country]
+    if missing:
+        new = compute_profiles(filename, variable, missing, off_filename, n_processes)
+        cube = new if cube is None else xr.concat([cube, new], dim="country")
+        DS = cube.to_dataset()
+        DS.attrs["mtimes"] = mtimes
+        DS.to_netcdf(cache)
+    return cube.sel(country=country_names)
+
+
+# plot the time-mean profiles of some countries against altitude, with the cruise band shaded. time selects a single
+# time step (index) instead of the mean
+def plot_profiles(filename, variable, country_names, off_filename=None, time=None, ax=None):
+    from matplotlib import pyplot as plt
+
+    cube = load_profiles(filename, variable, country_names, off_filename)
+    profiles = cube.mean("time") if time is None else cube.isel(time=time)
+    if ax is None:
+        ax = plt.gca()
+    for name in country_names:
+        ax.plot(profiles.sel(country=name), profiles.altitude, label=name)
+    ax.axhspan(*columns["cruise"], color="grey", alpha=0.2, label="cruise")
+    ax.set_xlabel(variable + ("" if off_filename is None else " ON - OFF") + " [" + cube.attrs["units"] + "]")
+    ax.set_ylabel("Altitude [km]")
+    ax.legend()
+    return ax
+
+
+if __name__ == "__main__":
+    from matplotlib import pyplot as plt
+
+    on, off = "../Data/Soot.24h.JAN.ON.nc4", "../Data/Soot.24h.JAN.OFF.nc4"
+    plot_profiles(on, "AerMassBC", ["Netherlands", "Spain", "Poland", "United Kingdom"], off)
+    plt.title("Aviation BC above countries (January mean)")
+    plt.ylim(0, 16)
+    plt.show()
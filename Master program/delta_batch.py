@@ -0,0 +1,154 @@
+from netCDF4 import Dataset as netcdf_dataset
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import sys
+import os
+from catalog import load_catalog, complete_pairs, name_pattern
+
+"""
+Batch production of the aviation-attributable part of the simulation results. For every ON/OFF pair in the catalog a
+delta file (ON - OFF) is written, and optionally a file with the relative change (ON - OFF) / OFF. The outputs have
+the same variables, dimensions and attributes as the inputs, are zlib compressed and chunked per map, and are named
+
+    <species>.<freq>.<month>.DELTA.nc4 and <species>.<freq>.<month>.REL.nc4
+
+in output_dir. The inputs are read in blocks of time steps, so memory use does not depend on the length of the run,
+and the pairs are divided over a pool of processes. Pairs whose outputs are newer than both inputs are skipped. Every
+output records the paths of its inputs (attributes Source_ON and Source_OFF), so that delta_file() only hands out a
+delta that was made from the files the caller would otherwise read.
+
+Usage: python delta_batch.py [data directory] [--relative]
+"""
+
+output_dir = "../Data/delta/"
+time_block = 24  # number of time steps read at once
+compression = 4
+processes = cpu_count()
+
+
+def output_filename(pair, kind):
+    return os.path.join(output_dir, ".".join((pair["species"], pair["freq"], pair["month"], kind, "nc4")))
+
+
+# check whether an output is newer than both of its inputs
+def output_is_valid(pair, kind):
+    filename = output_filename(pair, kind)
+    return os.path.exists(filename) and \
+        os.path.getmtime(filename) > max(os.path.getmtime(pair["ON"]), os.path.getmtime(pair["OFF"]))
+
+
+# create an output file with the same dimensions, coordinates and attributes as the source, and empty data variables
+# for the variables that are in both inputs
+def create_output(filename, src, variables, description, sources):
+    dst = netcdf_dataset(filename, "w", format="NETCDF4")
+    dst.setncatts({name: src.getncattr(name) for name in src.ncattrs()})
+    dst.setncattr("Derived", description)
+    dst.setncattr("Source_ON", os.path.abspath(sources["ON"]))
+    dst.setncattr("Source_OFF", os.path.abspath(sources["OFF"]))
+    for name, dim in src.dimensions.items():
+        dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+    for name, var in src.variables.items():
+        if name in variables:
+            chunks = [1 if dim in ("time", "lev") else size for dim, size in zip(var.dimensions, var.shape)]
+            out = dst.createVariable(name, np.float32, var.dimensions, zlib=True, complevel=compression,
+                                     chunksizes=chunks, fill_value=np.float32(np.nan))
+        elif name in src.dimensions or var.ndim <= 1:
+            out = dst.createVariable(name, var.dtype, var.dimensions)
+        else:
+            continue
+        out.setncatts({key: var.getncattr(key) for key in var.ncattrs() if key != "_FillValue"})
+        if name not in variables:
+            out[...] = var[...]
+    return dst
+
+
+# the blocks in which a variable is processed: slices of time_block time steps, or everything if there is no time
+def blocks(var):
+    if "time" not in var.dimensions:
+        return [tuple(slice(None) for _ in var.dimensions)]
+    axis = var.dimensions.index("time")
+    result = []
+    for start in range(0, var.shape[axis], time_block):
+        block = [slice(None)] * var.ndim
+        block[axis] = slice(start, min(start + time_block, var.shape[axis]))
+        result.append(tuple(block))
+    return result
+
+
+# write the delta (and relative change) files of one ON/OFF pair
+def process_pair(pair, relative=False):
+    os.makedirs(output_dir, exist_ok=True)
+    on = netcdf_dataset(pair["ON"])
+    off = netcdf_dataset(pair["OFF"])
+
+    # only data variables with at least a lat/lon map that are in both files
+    variables = [name for name, var in on.variables.items()
+                 if var.ndim >= 2 and name in off.variables and name not in on.dimensions]
+
+    outputs = {"DELTA": create_output(output_filename(pair, "DELTA"), on, variables, "ON - OFF", pair)}
+    if relative:
+        outputs["REL"] = create_output(output_filename(pair, "REL"), on, variables, "(ON - OFF) / OFF", pair)
+
+    for name in variables:
+        for block in blocks(on.variables[name]):
+            on_values = np.ma.filled(on.variables[name][block].astype(np.float32), np.nan)
+            off_values = np.ma.filled(off.variables[name][block].astype(np.float32), np.nan)
+            delta = on_values - off_values
+            outputs["DELTA"].variables[name][block] = delta
+            if relative:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    outputs["REL"].variables[name][block] = np.where(off_values != 0, delta / off_values, np.nan)
+
+    for dst in outputs.values():
+        dst.close()
+    on.close()
+    off.close()
+    return os.path.basename(output_filename(pair, "DELTA"))
+
+
+def _process_pair(args):
+    return process_pair(*args)
+
+
+# write the outputs for all complete pairs in the catalog of the given directories that are not up to date yet
+def process_directory(dirs, relative=False, n_processes=processes):
+    catalog = load_catalog(dirs=dirs, filename=os.path.join(dirs[0], "catalog.json"))
+    kinds = ["DELTA", "REL"] if relative else ["DELTA"]
+    todo = [(pair, relative) for pair in complete_pairs(catalog)
+            if not all(output_is_valid(pair, kind) for kind in kinds)]
+    if not todo:
+        print("All delta files are up to date")
+        return
+
+    if n_processes > 1 and len(todo) > 1:
+        with Pool(min(n_processes, len(todo))) as pool:
+            for name in pool.imap_unordered(_process_pair, todo):
+                print("Written", name)
+    else:
+        for args in todo:
+            print("Written", _process_pair(args))
+
+
+# path of the delta file of an ON/OFF pair, for tools that want to read the precomputed difference instead of the two
+# files. Returns None if it has not been produced yet, if it is older than one of the files, or if it was made from
+# other files (e.g. the pair in ../Data instead of a local copy)
+def delta_file(on_filename, off_filename):
+    match = name_pattern.match(os.path.basename(on_filename))
+    if match is None:
+        return None
+    pair = dict(match.groupdict(), ON=on_filename, OFF=off_filename)
+    if not output_is_valid(pair, "DELTA"):
+        return None
+
+    filename = output_filename(pair, "DELTA")
+    with netcdf_dataset(filename) as ds:
+        sources = [getattr(ds, "Source_ON", None), getattr(ds, "Source_OFF", None)]
+    if sources != [os.path.abspath(on_filename), os.path.abspath(off_filename)]:
+        return None
+    return filename
+
+
+if __name__ == "__main__":
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    process_directory(arguments or ["../Data/"], relative="--relative" in sys.argv)
@@ -0,0 +1,231 @@
+import xarray as xr
+import numpy as np
+import math
+from parallel_stats import block_plan, read_block, variable_info
+from point_query import grid_axes, weighted_mean
+
+"""
+Diurnal cycle composites of the hourly files: the mean and percentiles of every hour of the day, per grid cell (and
+level) and per location (country, box or point from point_query), for aircraft ON, OFF and ON - OFF.
+
+The files are read once, in blocks of time steps. Each block is added to accumulators per hour of the day: sums and
+numbers of valid values for the means, and histograms for the percentiles. The histogram range is found in the same
+pass: it starts at the range of the first block, and when a block has values outside it the range is widened by a
+power of two, centred on the values so far and with edges on the old bin edges, so the old counts are merged into the
+new bins exactly. The final bins are typically two to three times as wide as (max - min) / n_bins, and a percentile is
+accurate to about a bin width.
+Percentiles per grid cell are only computed for maps (files without levels, or a selected level), because histograms
+of every level would need too much memory; the means are always available.
+
+Hours are UTC, or local solar time (UTC + longitude / 15 hours, rounded) when local is set. For locations the local
+time of their area-weighted mean longitude is used.
+"""
+
+n_bins = 64  # number of histogram bins per hour and cell
+
+
+# hour of the day (UTC) of every time step
+def utc_hours(filename):
+    with xr.open_dataset(filename) as DS:
+        return DS.time.dt.hour.values
+
+
+# hours between local solar time and UTC at the given longitudes
+def hour_offsets(lon):
+    return np.round(np.asarray(lon) / 15).astype(int)
+
+
+# accumulator of the sums, numbers of valid values and (with_histogram) histograms per hour. The histogram bins (low,
+# width) are set by the first values that are added; range is the minimum and maximum of the values so far
+def new_accumulator(shape, with_histogram):
+    acc = {"sum": np.zeros((24,) + shape), "count": np.zeros((24,) + shape, dtype=np.int64), "low": None,
+           "width": None, "range": None, "histogram": None}
+    if with_histogram:
+        acc["histogram"] = np.zeros((24, n_bins) + shape, dtype=np.uint32)
+    return acc
+
+
+# widen the histogram range of an accumulator so that it covers the values. The bin width grows by a power of two
+# and the new edges are old edges, so every old bin falls into exactly one new bin. The new range is centred on the
+# values seen so far, so that it has room on both sides for the next blocks
+def widen(acc, values):
+    if acc["histogram"] is None or np.isnan(values).all():
+        return
+    low, high = float(np.nanmin(values)), float(np.nanmax(values))
+    if acc["low"] is None:
+        width = (high - low) / n_bins
+        if not width > 0:  # all values equal: bins that are small compared to the value, widened later if needed
+            width = (abs(low) or 1E-30) / n_bins
+        acc["low"], acc["width"], acc["range"] = low, width, (low, high)
+        return
+
+    old_low, width = acc["low"], acc["width"]
+    low, high = min(low, acc["range"][0]), max(high, acc["range"][1])
+    acc["range"] = (low, high)
+    if low >= old_low and high <= old_low + n_bins * width:
+        return
+    # in units of old bins from old_low: the data lies in [first, last], the old bins in [0, n_bins]
+    first, last = (low - old_low) / width, (high - old_low) / width
+    factor = 2 ** max(1, math.ceil(math.log2((max(last, n_bins) - min(first, 0)) / n_bins)))
+    # the new range starts shift old bins below old_low, and must hold the old bins and the data
+    centred = round(n_bins * factor / 2 - (first + last) / 2)
+    shift = min(max(centred, math.ceil(-first), 0), n_bins * factor - max(math.ceil(last), n_bins))
+    histogram = np.zeros_like(acc["histogram"])
+    for i in range(n_bins):
+        histogram[:, (i + shift) // factor] += acc["histogram"][:, i]
+    acc["histogram"] = histogram
+    acc["low"], acc["width"] = old_low - shift * width, width * factor
+
+
+# add a block of values (time, ...) with the hour of every time step to an accumulator
+def accumulate(acc, values, hours):
+    widen(acc, values)
+    for hour in np.unique(hours):
+        selected = values[hours == hour]
+        valid = ~np.isnan(selected)
+        acc["sum"][hour] += np.where(valid, selected, 0).sum(axis=0)
+        acc["count"][hour] += valid.sum(axis=0)
+
+        if acc["histogram"] is not None and acc["low"] is not None:
+            n_cells = int(np.prod(selected.shape[1:]))
+            with np.errstate(invalid="ignore"):
+                bins = np.clip(((selected - acc["low"]) / acc["width"]).astype(np.int64), 0, n_bins - 1)
+            index = bins * n_cells + np.arange(n_cells).reshape(selected.shape[1:])
+            counts = np.bincount(index[valid], minlength=n_bins * n_cells)
+            acc["histogram"][hour] += counts.reshape((n_bins,) + selected.shape[1:]).astype(np.uint32)
+
+
+# percentile q of the values in a histogram accumulator, for every hour and cell. Values are spread evenly within bins
+def histogram_percentile(acc, q):
+    low, width = (0, 1) if acc["low"] is None else (acc["low"], acc["width"])
+    cumulative = np.cumsum(acc["histogram"], axis=1)
+    target = q / 100 * acc["count"]
+    index = np.minimum((cumulative < target[:, np.newaxis]).sum(axis=1), n_bins - 1)
+    below = np.where(index > 0, np.take_along_axis(cumulative, np.maximum(index - 1, 0)[:, np.newaxis], 1)[:, 0], 0)
+    in_bin = np.take_along_axis(acc["histogram"], index[:, np.newaxis], 1)[:, 0]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.clip((target - below) / in_bin, 0, 1)
+        return np.where(acc["count"] > 0, low + (index + fraction) * width, np.nan)
+
+
+# shift the hour axis (the first one) from UTC to local time, with one offset per element of the given axis
+def to_local(values, offsets, axis):
+    local = np.empty_like(values)
+    for offset in np.unique(offsets):
+        selected = [slice(None)] * values.ndim
+        selected[axis] = offsets == offset
+        local[tuple(selected)] = np.roll(values[tuple(selected)], offset, axis=0)
+    return local
+
+
+# the composites of one accumulator as a Dataset: mean, number of valid values (samples) and percentiles per hour
+def composite_dataset(acc, dims, coords, percentiles, offsets, axis):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = acc["sum"] / acc["count"]
+    variables = {"mean": mean}
+    if acc["histogram"] is not None:
+        variables["percentile"] = np.stack([histogram_percentile(acc, q) for q in percentiles])
+    if offsets is not None:
+        variables["mean"] = to_local(mean, offsets, axis)
+        if "percentile" in variables:
+            variables["percentile"] = np.stack([to_local(values, offsets, axis)
+                                                for values in variables["percentile"]])
+        variables["samples"] = to_local(acc["count"], offsets, axis)
+    else:
+        variables["samples"] = acc["count"]
+
+    data_vars = {"mean": (["hour"] + dims, variables["mean"]), "samples": (["hour"] + dims, variables["samples"])}
+    if "percentile" in variables:
+        data_vars["percentile"] = (["q", "hour"] + dims, variables["percentile"])
+    return xr.Dataset(data_vars, coords=dict(coords, hour=np.arange(24), q=list(percentiles)))
+
+
+# diurnal cycle composites of a variable for aircraft ON, OFF (if off_filename is given) and ON - OFF. level is a lev
+# value (nearest level), or None for all levels. where (from point_query) adds composites per location. Returns a
+# dictionary {"ON": ..., "OFF": ..., "DELTA": ...} of Datasets with the variables mean, samples and percentile
+# (dimensions q, hour, ...), with the grid composites over (lat, lon) or (lev, lat, lon) and the location composites
+# prefixed with location_ over (location)
+def diurnal_composites(filename, variable, off_filename=None, level=None, local=False, percentiles=(5, 50, 95),
+                       where=None):
+    dims, shape, coords = variable_info(filename, variable)
+    hours = utc_hours(filename)
+    sources = {"ON": (filename, None)}
+    if off_filename is not None:
+        sources.update(OFF=(off_filename, None), DELTA=(filename, off_filename))
+
+    level_index = None
+    if "lev" in dims and level is not None:
+        level_index = int(np.argmin(np.abs(coords["lev"] - level)))
+    map_dims = [dim for dim in dims if dim != "time" and not (dim == "lev" and level_index is not None)]
+    map_shape = tuple(size for dim, size in zip(dims, shape) if dim in map_dims)
+    with_histogram = len(percentiles) > 0 and "lev" not in map_dims
+
+    if where is not None:
+        cells, weights = where["index"](*grid_axes(filename))
+
+    grid_acc, location_acc = {}, {}
+    for kind in sources:
+        grid_acc[kind] = new_accumulator(map_shape, with_histogram)
+        if where is not None:
+            location_acc[kind] = new_accumulator(map_shape[:-2] + (len(where["names"]),), len(percentiles) > 0)
+
+    # a single pass over the file: each block of time steps is read once per file. With a selected level the blocks
+    # are only planned over the other dimensions, so no time step is read twice
+    plan = [(dim, size) for dim, size in zip(dims, shape) if not (dim == "lev" and level_index is not None)]
+    for block in block_plan([dim for dim, _ in plan], [size for _, size in plan], n_processes=1):
+        if level_index is not None:
+            block["lev"] = level_index
+        on_values = read_block(filename, variable, block)
+        values = {"ON": on_values}
+        if off_filename is not None:
+            values["OFF"] = read_block(off_filename, variable, block)
+            values["DELTA"] = on_values - values["OFF"]
+
+        block_hours = hours[block["time"]]
+        for kind in sources:
+            accumulate(grid_acc[kind], values[kind], block_hours)
+            if where is not None:
+                flat = values[kind].reshape(values[kind].shape[:-2] + (-1,))
+                accumulate(location_acc[kind], weighted_mean(flat, cells, weights), block_hours)
+
+    # local time offsets per longitude, and per location at the area-weighted mean longitude
+    lon_axis, lat_axis = grid_axes(filename)
+    grid_offsets = hour_offsets(lon_axis) if local else None
+    if where is not None and local:
+        lon_flat = np.tile(lon_axis, len(lat_axis))
+        location_offsets = hour_offsets(np.nansum(lon_flat[cells] * weights, axis=1))
+
+    result = {}
+    for kind in sources:
+        grid_coords = {dim: coords[dim] for dim in map_dims if dim in coords}
+        result[kind] = composite_dataset(grid_acc[kind], map_dims, grid_coords, percentiles, grid_offsets,
+                                         len(map_dims))
+        if where is not None:
+            location_dims = map_dims[:-2] + ["location"]
+            location_coords = dict({dim: coords[dim] for dim in map_dims[:-2] if dim in coords},
+                                   location=where["names"])
+            locations = composite_dataset(location_acc[kind], location_dims, location_coords, percentiles,
+                                          location_offsets if local else None, len(location_dims))
+            result[kind] = result[kind].merge(locations.rename({name: "location_" + name
+                                                                 for name in locations.data_vars}))
+    return result
+
+
+if __name__ == "__main__":
+    from matplotlib import pyplot as plt
+    from point_query import countries
+
+    on, off = "../Data/O3.1h.JUL.ON.nc4", "../Data/O3.1h.JUL.OFF.nc4"
+    names = ["Netherlands", "Spain", "Poland"]
+    composites = diurnal_composites(on, "SpeciesConc_O3", off, local=True, where=countries(names))
+
+    delta = composites["DELTA"]
+    for i, name in enumerate(names):
+        line, = plt.plot(delta.hour, delta.location_mean[:, i], label=name)
+        plt.fill_between(delta.hour, delta.location_percentile[0, :, i], delta.location_percentile[-1, :, i],
+                         color=line.get_color(), alpha=0.2)
+    plt.xlabel("Local solar time [h]")
+    plt.ylabel("O3 ON - OFF [mol mol-1]")
+    plt.title("Diurnal cycle of aviation-attributable O3, July")
+    plt.legend()
+    plt.show()
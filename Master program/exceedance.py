@@ -0,0 +1,154 @@
+from netCDF4 import Dataset as netcdf_dataset
+import xarray as xr
+import numpy as np
+import json
+import parallel_stats
+from point_query import grid_axes, weighted_mean
+
+"""
+Air quality exceedance statistics from the hourly files, with and without aircraft:
+
+    - O3: the maximum daily 8-hour mean (MDA8) above 120 ug/m3 (EU target value)
+    - PM2.5: the daily mean above 15 ug/m3 (WHO 2021 guideline for 24-hour means)
+
+The daily metric is computed for every grid cell with vectorized operations: 8-hour rolling means come from differences
+of a cumulative sum along time, and the daily reductions from np.fmax.reduceat and np.add.reduceat over the first
+hour of every day. Following the EU rules, an 8-hour window is assigned to the day in which it ends, and a rolling mean
+needs 6 valid hours (a daily mean 18). The files are read in bands of latitude rows with all time steps, so the
+windows never have to cross a block boundary, and the size of a band follows from parallel_stats.memory_budget.
+
+For every cell, exceedances() counts the days above the threshold with aircraft ON and OFF, the difference, the days
+that only exceed because of aviation (ON above, OFF below), and the mean change of the daily metric. With locations
+from point_query (e.g. countries) the same is done for the area-weighted daily metric of every location, together
+with the area-weighted mean of the cell counts. These are added to the same Dataset with the prefix location_ and the
+dimension location, so the result has the same type with and without locations.
+"""
+
+o3_threshold = 120.0  # ug/m3, EU target value for the maximum daily 8-hour mean
+pm25_threshold = 15.0  # ug/m3, WHO 2021 guideline for the daily mean
+min_valid = 0.75  # fraction of valid hours needed for a rolling or daily mean
+
+# conversion of the O3 mixing ratio (mol/mol) to ug/m3 at the reference conditions of the EU directive
+reference_pressure = 101325.0  # Pa
+reference_temperature = 293.15  # K
+gas_constant = 8.314462  # J/(mol K)
+o3_molar_mass = 48.00  # g/mol
+o3_to_ug = reference_pressure * o3_molar_mass / (gas_constant * reference_temperature) * 1E6
+
+# for every kind of statistic: variable, conversion factor to ug/m3, threshold and daily metric
+metrics = {
+    "O3": {"variable": "SpeciesConc_O3", "factor": o3_to_ug, "threshold": o3_threshold, "metric": "MDA8"},
+    "PM25": {"variable": "PM25", "factor": 1.0, "threshold": pm25_threshold, "metric": "daily mean"},
+}
+
+
+# index of the first time step of every day, and the dates
+def day_starts(times):
+    dates = times.astype("datetime64[D]")
+    starts = np.flatnonzero(np.concatenate(([True], dates[1:] != dates[:-1])))
+    return starts, dates[starts]
+
+
+# rolling mean over the last `window` time steps (axis 0), ending at every time step. Windows with fewer than
+# min_valid * window valid values are NaN
+def rolling_mean(values, window):
+    valid = ~np.isnan(values)
+    zero = np.zeros((1,) + values.shape[1:])
+    total = np.concatenate((zero, np.cumsum(np.where(valid, values, 0), axis=0)))
+    count = np.concatenate((zero, np.cumsum(valid, axis=0)))
+    start = np.maximum(np.arange(1, len(values) + 1) - window, 0)
+    window_total = total[1:] - total[start]
+    window_count = count[1:] - count[start]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(window_count >= min_valid * window, window_total / window_count, np.nan)
+
+
+# maximum daily 8-hour mean of hourly values (time, ...), per day
+def mda8(values, starts):
+    return np.fmax.reduceat(rolling_mean(values, 8), starts, axis=0)
+
+
+# daily mean of hourly values (time, ...), NaN for days with fewer than min_valid * 24 valid hours
+def daily_mean(values, starts):
+    valid = ~np.isnan(values)
+    total = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+    count = np.add.reduceat(valid, starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count >= min_valid * 24, total / count, np.nan)
+
+
+# the daily metric (days, lat, lon) in ug/m3 of a file, read in bands of latitude rows
+def daily_metric(filename, kind):
+    settings = metrics[kind]
+    with xr.open_dataset(filename) as DS:
+        starts, dates = day_starts(DS.time.values)
+
+    with netcdf_dataset(filename) as ds:
+        var = ds.variables[settings["variable"]]
+        n_time, n_lat, n_lon = var.shape
+        row_bytes = n_time * n_lon * 8 * 4  # the values and the cumulative sums of one latitude row
+        rows = max(1, parallel_stats.memory_budget // row_bytes)
+        metric = np.empty((len(starts), n_lat, n_lon))
+        for first in range(0, n_lat, rows):
+            band = slice(first, min(first + rows, n_lat))
+            values = np.ma.filled(var[:, band, :].astype(np.float64), np.nan) * settings["factor"]
+            metric[:, band, :] = mda8(values, starts) if kind == "O3" else daily_mean(values, starts)
+    return metric, dates
+
+
+# exceedance statistics for aircraft ON and OFF. kind is "O3" or "PM25". Returns a Dataset with the daily metrics and
+# the counts per cell, and if where (from point_query) is given also the statistics per location (location_<name>)
+def exceedances(on_filename, off_filename, kind, where=None):
+    threshold = metrics[kind]["threshold"]
+    metric_on, dates = daily_metric(on_filename, kind)
+    metric_off, _ = daily_metric(off_filename, kind)
+    lon, lat = grid_axes(on_filename)
+
+    def counts(on, off):
+        above_on, above_off = on > threshold, off > threshold
+        return {"days_on": above_on.sum(axis=0), "days_off": above_off.sum(axis=0),
+                "days_delta": above_on.sum(axis=0) - above_off.sum(axis=0),
+                "days_aviation": (above_on & ~above_off).sum(axis=0),  # only exceeded because of aircraft
+                "metric_delta": np.nanmean(on - off, axis=0)}
+
+    cell_counts = counts(metric_on, metric_off)
+    dims = ["lat", "lon"]
+    cells = xr.Dataset({name: (dims, values) for name, values in cell_counts.items()}, coords={"lat": lat, "lon": lon})
+    cells["metric_on"] = (["day"] + dims, metric_on)
+    cells["metric_off"] = (["day"] + dims, metric_off)
+    cells = cells.assign_coords(day=dates)
+    cells.attrs.update(metric=metrics[kind]["metric"], threshold=threshold, units="ug m-3")
+    if where is None:
+        return cells
+
+    # per location: exceedances of the area-weighted daily metric, and the area-weighted mean of the cell counts
+    index, weights = where["index"](lon, lat)
+    location_counts = counts(weighted_mean(metric_on.reshape(len(dates), -1), index, weights),
+                             weighted_mean(metric_off.reshape(len(dates), -1), index, weights))
+    for name in ("days_on", "days_off", "days_delta", "days_aviation"):
+        location_counts["cell_" + name] = weighted_mean(cell_counts[name].ravel(), index, weights)
+    for name, values in location_counts.items():
+        cells["location_" + name] = (["location"], values)
+    return cells.assign_coords(location=where["names"])
+
+
+if __name__ == "__main__":
+    from catalog import load_catalog, resolve_pair
+    from point_query import countries
+
+    catalog = load_catalog()
+    country_names = ["Austria", "Belgium", "France", "Germany", "Italy", "Netherlands", "Poland", "Spain",
+                     "Switzerland", "United Kingdom"]
+    report = {}
+    for kind in metrics:
+        for month in ("JAN", "JUL"):
+            on, off = resolve_pair(catalog, kind, "1h", month)
+            cells = exceedances(on, off, kind, countries(country_names))
+            per_country = cells[[name for name in cells.data_vars if name.startswith("location_")]]
+            print("{} {} ({} > {:g} ug/m3): {} cell-days with aircraft, {} without, {} due to aviation".format(
+                kind, month, cells.attrs["metric"], cells.attrs["threshold"], int(cells.days_on.sum()),
+                int(cells.days_off.sum()), int(cells.days_aviation.sum())))
+            report[kind + "." + month] = per_country.to_dataframe().dropna().to_dict(orient="index")
+
+    with open("exceedance.json", "w") as outfile:
+        json.dump(report, outfile, indent=4)
@@ -0,0 +1,63 @@
+import numpy as np
+
+"""
+Temporal interpolation of animation frames. Between every two stored time steps, sub_frames extra frames are made by
+linear blending of the two neighbouring time steps:
+
+    frame = a + f * (b - a),    f = 1 / (sub_frames + 1), 2 / (sub_frames + 1), ...
+
+Only the two neighbouring time steps are kept in memory, and each of them is read once: when the animation moves on
+to the next pair, the newer frame of the old pair is reused. The blended frame is written into the same output array
+every time, so playing the animation smoothly does not cost any extra I/O or memory.
+"""
+
+
+# total number of frames when sub_frames frames are added between each of the n_stored time steps
+def n_frames(n_stored, sub_frames):
+    return (n_stored - 1) * (sub_frames + 1) + 1
+
+
+# the stored time step before frame i and the blending factor towards the next time step
+def frame_position(i, sub_frames):
+    k, j = divmod(i, sub_frames + 1)
+    return k, j / (sub_frames + 1)
+
+
+# returns a function that gives frame i of the interpolated sequence. read_frame(k) has to return the stored time
+# step k as an array; it is called at most once per time step as long as the frames are requested in order
+def interpolated_frames(read_frame, n_stored, sub_frames):
+    cache = {}  # at most two stored time steps: index -> array
+    state = {"out": None}
+
+    def get(k):
+        if k not in cache:
+            # forget everything except the frame that is still needed, then read the new one
+            for old in [key for key in cache if key not in (k - 1, k + 1)]:
+                del cache[old]
+            cache[k] = np.asarray(read_frame(k), dtype=np.float32)
+        return cache[k]
+
+    def frame(i):
+        k, f = frame_position(i, sub_frames)
+        a = get(k)
+        if f == 0 or k + 1 >= n_stored:
+            return a
+
+        b = get(k + 1)
+        if state["out"] is None or state["out"].shape != a.shape:
+            state["out"] = np.empty_like(a)
+        out = state["out"]
+        np.subtract(b, a, out=out)
+        out *= f
+        out += a
+        return out
+
+    return frame
+
+
+# the time belonging to frame i, interpolated between the stored times (numpy datetime64 array)
+def frame_time(times, i, sub_frames):
+    k, f = frame_position(i, sub_frames)
+    if f == 0 or k + 1 >= len(times):
+        return times[k]
+    return times[k] + (times[k + 1] - times[k]) * f
@@ -3,9 +3,15 @@ from matplotlib import pyplot as plt, animation
 import numpy as np
 import cartopy.crs as ccrs
 from GUI import Select_pollutant
+from frame_interpolation import interpolated_frames, n_frames, frame_time
+from slice_stats import data_array_limits
+from stage_trace import span, traced, write_trace
 
+# timing and memory of the stages, rewritten after every plot (.json or .csv)
+trace_file = "master_trace.json"
 
-def show_plot(da, level, time):
+
+def show_plot(da, level, time, limits):
     if hasattr(da, 'lev') and level > 0:
         da = getattr(da, "sel")(lev=level, method='nearest')
 
@@ -13,17 +19,23 @@ def show_plot(da, level, time):
         da = getattr(da, "sel")(time=time)
     proj = ccrs.PlateCarree()
 
-    # Create axes and add map
-    ax = plt.axes(projection=proj)  # create axes
-    ax.coastlines(resolution='50m')  # draw coastlines with given resolution
+    with span("Drawing the map"):
+        # Create axes and add map
+        ax = plt.axes(projection=proj)  # create axes
+        ax.coastlines(resolution='50m')  # draw coastlines with given resolution
 
-    # Set color and scale of plot
-    da.plot(add_colorbar=True, cmap='coolwarm', vmin=da.values.min(), vmax=da.values.max(),
-            cbar_kwargs={'extend': 'neither'})
+        # Set color and scale of plot, with the limits from the precomputed statistics of the file
+        da.plot(add_colorbar=True, cmap='coolwarm', vmin=limits[0], vmax=limits[1],
+                cbar_kwargs={'extend': 'neither'})
 
     plt.show()
 
-def animate_plot(var,level):
+
+# number of interpolated frames shown between two time steps of the data, for smoother animations
+sub_frames = 3
+
+
+def animate_plot(var,level, limits):
 
 
     # Check if there are different altitude levels
@@ -38,9 +50,11 @@ def animate_plot(var,level):
     # select projection. Only seems to work with PlateCarree though
     proj = ccrs.PlateCarree()
 
-    # Determine number of points in time
+    # Determine number of points in time, and the number of frames including the interpolated ones
 
     n = da.time.size
+    frame_data = interpolated_frames(lambda k: da[k, :, :].values, n, sub_frames)
+    times = da.coords["time"].values
 
     # Create subplot
     fig, ax = plt.subplots(figsize=(12, 6))
@@ -49,23 +63,25 @@ def animate_plot(var,level):
     ax = plt.axes(projection=proj)  # create axes
     ax.coastlines(resolution='50m')  # draw coastlines with given resolution
 
-    # Set color and scale of plot
-    cax = da[0, :, :].plot(add_colorbar=True,
-                           cmap='coolwarm',
-                           vmin=da.values.min(),
-                           vmax=da.values.max(),
-                           cbar_kwargs={'extend': 'neither'})
+    # Set color and scale of plot, the same for all frames
+    with span("Drawing the first frame"):
+        cax = da[0, :, :].plot(add_colorbar=True,
+                               cmap='coolwarm',
+                               vmin=limits[0],
+                               vmax=limits[1],
+                               cbar_kwargs={'extend': 'neither'})
 
     # Animation function
+    @traced("Animation frame")
     def animate(frame):
-        cax.set_array(da[frame, :, :].values.flatten())
+        cax.set_array(frame_data(frame).ravel())
         ax.set_title("Time = " +
-                     str(da.coords["time"].values[frame])[:13])
+                     str(frame_time(times, frame, sub_frames))[:16])
 
     # Animate plots
     ani = animation.FuncAnimation(fig, animate,
-                                  frames=n,
-                                  interval=100)
+                                  frames=n_frames(n, sub_frames),
+                                  interval=100 / (sub_frames + 1))
     # Show plot
     plt.show()
 
@@ -78,8 +94,13 @@ while running:
 
     print(Anim_state)
 
+    # colour limits of the selected level, of ON - OFF if an OFF file was chosen
+    with span("Colour limits"):
+        limits = data_array_limits(filepath, None if isinstance(file_sub, int) else file_sub, lev)
+
     if Anim_state:
-        animate_plot(filepath - file_sub, lev)
+        animate_plot(filepath - file_sub, lev, limits)
     else:
-        show_plot(filepath - file_sub, lev, time)
+        show_plot(filepath - file_sub, lev, time, limits)
+    write_trace(trace_file)
 
@@ -0,0 +1,174 @@
+from netCDF4 import Dataset as netcdf_dataset
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import itertools
+import xarray as xr
+from point_query import grid_axes, weighted_mean
+
+"""
+Out-of-core statistics of large data files (month-long hourly or full-column files that don't fit in memory):
+
+    time_mean(filename, variable)           mean over time, per level and grid cell
+    level_sum(filename, variable, levels)   sum over a range of levels, per time step and grid cell
+    grouped_series(filename, variable, where)
+                                            area-weighted mean per country/box/point and time step, where the
+                                            locations come from point_query (countries, boxes, points)
+
+Each of them can work on the aircraft-attributable part directly by also giving the OFF file (off_filename), in which
+case ON - OFF is computed block by block and never stored as a whole.
+
+The variable is split into blocks of time steps (and levels, if a single time step is too large) that are reduced
+independently by a pool of processes; the partial results are combined in the main process as they come in. The
+block size follows from memory_budget: all processes together never hold more than about that much data, so the
+memory use does not depend on the size of the file, and the work is spread over all cores.
+"""
+
+memory_budget = 2 * 1024 ** 3  # bytes of data that may be in memory at the same time, over all processes
+processes = cpu_count()
+copies = 3  # arrays of block size that a task holds at the same time (ON, OFF and the result of an operation)
+
+
+# the blocks in which a variable is processed, as dictionaries with a slice for time and lev. A block of a single
+# process is at most memory_budget / (processes * copies) bytes
+def block_plan(dims, shape, itemsize=8, n_processes=processes, budget=None):
+    sizes = dict(zip(dims, shape))
+    block_bytes = max(1, (budget or memory_budget) // (n_processes * copies))
+    map_bytes = sizes.get("lat", 1) * sizes.get("lon", 1) * itemsize
+
+    n_lev = sizes.get("lev", 1)
+    lev_block = max(1, min(n_lev, block_bytes // map_bytes))
+    time_block = max(1, block_bytes // (map_bytes * lev_block)) if lev_block == n_lev else 1
+
+    blocks = []
+    for t, k in itertools.product(range(0, sizes.get("time", 1), time_block), range(0, n_lev, lev_block)):
+        block = {}
+        if "time" in sizes:
+            block["time"] = slice(t, min(t + time_block, sizes["time"]))
+        if "lev" in sizes:
+            block["lev"] = slice(k, min(k + lev_block, n_lev))
+        blocks.append(block)
+    return blocks
+
+
+# read a block of a variable as float64 with NaN for missing values, minus the OFF file if given. The block is returned
+# with the dimensions of the variable
+def read_block(filename, variable, block, off_filename=None):
+    with netcdf_dataset(filename) as ds:
+        var = ds.variables[variable]
+        key = tuple(block.get(dim, slice(None)) for dim in var.dimensions)
+        values = np.ma.filled(var[key].astype(np.float64), np.nan)
+    if off_filename is not None:
+        values -= read_block(off_filename, variable, block)
+    return values
+
+
+# the reductions of a single block. Each returns the block and its partial result
+def _time_sum(args):
+    filename, variable, block, off_filename, dims = args
+    values = read_block(filename, variable, block, off_filename)
+    axis = dims.index("time")
+    return block, np.nansum(values, axis=axis), np.sum(~np.isnan(values), axis=axis)
+
+
+def _level_sum(args):
+    filename, variable, block, off_filename, dims = args
+    values = read_block(filename, variable, block, off_filename)
+    return block, np.nansum(values, axis=dims.index("lev"))
+
+
+def _grouped(args):
+    filename, variable, block, off_filename, dims, cells, weights = args
+    values = read_block(filename, variable, block, off_filename)
+    values = values.reshape(values.shape[:-2] + (-1,))  # flatten the lat/lon map
+    return block, weighted_mean(values, cells, weights)
+
+
+# run the tasks on the pool and yield the results as they are finished
+def run_tasks(function, tasks, n_processes=processes):
+    if n_processes > 1 and len(tasks) > 1:
+        with Pool(min(n_processes, len(tasks))) as pool:
+            for result in pool.imap_unordered(function, tasks):
+                yield result
+    else:
+        for task in tasks:
+            yield function(task)
+
+
+def variable_info(filename, variable):
+    with netcdf_dataset(filename) as ds:
+        var = ds.variables[variable]
+        dims = list(var.dimensions)
+        shape = list(var.shape)
+    with xr.open_dataset(filename) as DS:
+        coords = {dim: DS[dim].values for dim in dims if dim in DS.coords}
+    return dims, shape, coords
+
+
+# mean over time of every level and grid cell, as a DataArray without the time dimension
+def time_mean(filename, variable, off_filename=None, n_processes=processes):
+    dims, shape, coords = variable_info(filename, variable)
+    out_dims = [dim for dim in dims if dim != "time"]
+    total = np.zeros([size for dim, size in zip(dims, shape) if dim != "time"])
+    count = np.zeros(total.shape)
+
+    tasks = [(filename, variable, block, off_filename, dims)
+             for block in block_plan(dims, shape, n_processes=n_processes)]
+    for block, block_sum, block_count in run_tasks(_time_sum, tasks, n_processes):
+        key = tuple(block.get(dim, slice(None)) for dim in out_dims)
+        total[key] += block_sum
+        count[key] += block_count
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    return xr.DataArray(mean, dims=out_dims, coords={dim: coords[dim] for dim in out_dims if dim in coords},
+                        name=variable)
+
+
+# sum over a range of levels (indices, e.g. slice(0, 8)), per time step and grid cell, as a DataArray without the lev
+# dimension
+def level_sum(filename, variable, levels=slice(None), off_filename=None, n_processes=processes):
+    dims, shape, coords = variable_info(filename, variable)
+    n_lev = shape[dims.index("lev")]
+    first, last, _ = levels.indices(n_lev)
+    out_dims = [dim for dim in dims if dim != "lev"]
+    out = np.zeros([size for dim, size in zip(dims, shape) if dim != "lev"])
+
+    tasks = []
+    for block in block_plan(dims, shape, n_processes=n_processes):
+        # only the part of the block that lies within the levels
+        start, stop = max(block["lev"].start, first), min(block["lev"].stop, last)
+        if start < stop:
+            tasks.append((filename, variable, dict(block, lev=slice(start, stop)), off_filename, dims))
+    for block, block_sum in run_tasks(_level_sum, tasks, n_processes):
+        out[tuple(block.get(dim, slice(None)) for dim in out_dims)] += block_sum
+
+    return xr.DataArray(out, dims=out_dims, coords={dim: coords[dim] for dim in out_dims if dim in coords},
+                        name=variable)
+
+
+# area-weighted mean per location and time step (and level, if the variable has levels), as a DataArray with a
+# location dimension instead of lat and lon. where comes from point_query.countries, boxes or points
+def grouped_series(filename, variable, where, off_filename=None, n_processes=processes):
+    dims, shape, coords = variable_info(filename, variable)
+    cells, weights = where["index"](*grid_axes(filename))
+    out_dims = dims[:-2] + ["location"]
+    out = np.zeros(shape[:-2] + [len(where["names"])])
+
+    tasks = [(filename, variable, block, off_filename, dims, cells, weights)
+             for block in block_plan(dims, shape, n_processes=n_processes)]
+    for block, block_series in run_tasks(_grouped, tasks, n_processes):
+        out[tuple(block.get(dim, slice(None)) for dim in dims[:-2])] = block_series
+
+    coords = {dim: coords[dim] for dim in dims[:-2] if dim in coords}
+    coords["location"] = where["names"]
+    return xr.DataArray(out, dims=out_dims, coords=coords, name=variable)
+
+
+if __name__ == "__main__":
+    from point_query import countries
+
+    on, off = "../Data/PM25.1h.JAN.ON.nc4", "../Data/PM25.1h.JAN.OFF.nc4"
+    print("Mean aviation PM2.5 over January:")
+    print(time_mean(on, "PM25", off).mean().values)
+    print("Hourly aviation PM2.5 per country:")
+    print(grouped_series(on, "PM25", countries(["Netherlands", "Germany", "France"]), off).mean("time").to_pandas())
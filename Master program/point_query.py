@@ -0,0 +1,224 @@
+from netCDF4 import Dataset as netcdf_dataset
+import cartopy.io.shapereader as shpreader
+import shapely
+import xarray as xr
+import numpy as np
+import os
+
+"""
+Time series of the data at receptor locations, without opening the files in the GUI. Locations are given as
+
+    - points(lons, lats, method): single locations (e.g. stations), with the value of the nearest grid cell or
+      bilinear interpolation between the four surrounding cells
+    - boxes([(lon_min, lon_max, lat_min, lat_max), ...]): area-weighted average over the grid cells in a box
+    - countries([name, ...]): area-weighted average over the grid cells whose centre lies in the country
+
+Every location is turned into a row of grid cell indices and weights. These index arrays are computed once per grid
+(the files don't all use the same grid) and reused for every file and variable, so a call with thousands of points
+costs one gather per block of time steps. query() returns a DataArray with dimensions (file, time, location), or
+(file, time, lev, location) if no level is selected, and query_pair() gives ON, OFF and ON - OFF, e.g.
+
+    schiphol = points([4.76], [52.31])
+    series = query_pair(resolve_pair(catalog, "O3", "1h", "JAN"), "SpeciesConc_O3", schiphol)
+"""
+
+shape_file = "../Country Group/Shapefiles/CNTR_RG_20M_2016_4326.shp"
+
+time_block = 24  # number of time steps read at once
+
+_axes_cache = {}  # filename: (lon, lat)
+_index_cache = {}  # (location id, grid): index
+
+
+# longitude and latitude axes of a file
+def grid_axes(filename):
+    if filename not in _axes_cache:
+        with netcdf_dataset(filename) as ds:
+            _axes_cache[filename] = (np.ma.filled(ds.variables["lon"][:], np.nan),
+                                     np.ma.filled(ds.variables["lat"][:], np.nan))
+    return _axes_cache[filename]
+
+
+# position of values on an axis as the index of the grid point below it and the fraction towards the next one.
+# Positions outside the axis get index -1
+def axis_position(axis, values):
+    i = np.clip(np.searchsorted(axis, values, side="right") - 1, 0, len(axis) - 2)
+    fraction = (values - axis[i]) / (axis[i + 1] - axis[i])
+    outside = (values < axis[0]) | (values > axis[-1])
+    i[outside] = -1
+    return i, fraction
+
+
+# a set of locations: a function that computes the index (cells and weights, both of shape (locations, k)) for a grid,
+# with the index cached per grid, and the names of the locations
+def locations(make_index, names, key):
+    def index(lon_axis, lat_axis):
+        grid = (key, len(lon_axis), len(lat_axis), float(lon_axis[0]), float(lat_axis[0]))
+        if grid not in _index_cache:
+            _index_cache[grid] = make_index(lon_axis, lat_axis)
+        return _index_cache[grid]
+
+    return {"index": index, "names": list(names)}
+
+
+# single points. method is "nearest" (value of the grid cell closest to the point) or "bilinear". Points outside the
+# grid give NaN
+def points(lons, lats, method="nearest", names=None):
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+
+    def make_index(lon_axis, lat_axis):
+        i_lon, f_lon = axis_position(lon_axis, lons)
+        i_lat, f_lat = axis_position(lat_axis, lats)
+        outside = (i_lon < 0) | (i_lat < 0)
+        n_lon = len(lon_axis)
+        if method == "nearest":
+            cells = ((i_lat + (f_lat > 0.5)) * n_lon + i_lon + (f_lon > 0.5))[:, np.newaxis]
+            weights = np.ones(cells.shape)
+        elif method == "bilinear":
+            corner = i_lat * n_lon + i_lon
+            cells = np.stack((corner, corner + 1, corner + n_lon, corner + n_lon + 1), axis=1)
+            weights = np.stack(((1 - f_lon) * (1 - f_lat), f_lon * (1 - f_lat), (1 - f_lon) * f_lat, f_lon * f_lat),
+                               axis=1)
+        else:
+            raise ValueError("Unknown method " + method + ", use nearest or bilinear")
+        cells[outside] = 0
+        weights[outside] = np.nan
+        return cells, weights
+
+    if names is None:
+        names = ["{:.3f}E {:.3f}N".format(lon, lat) for lon, lat in zip(lons, lats)]
+    return locations(make_index, names, ("points", method, lons.tobytes(), lats.tobytes()))
+
+
+# turn a list of boolean cell masks into an index, weighting every cell with its area (cos of the latitude). Masks
+# without any cells give NaN. Rows are padded to the same length with cell 0 and weight 0; weighted_mean() skips those
+def mask_index(masks, lat_axis):
+    area = np.repeat(np.cos(np.radians(lat_axis)), len(masks[0]) // len(lat_axis))
+    k = max(1, max(np.count_nonzero(mask) for mask in masks))
+    cells = np.zeros((len(masks), k), dtype=int)
+    weights = np.zeros((len(masks), k))
+    for row, mask in enumerate(masks):
+        selected = np.flatnonzero(mask)
+        if selected.size == 0:
+            weights[row] = np.nan
+            continue
+        cells[row, :selected.size] = selected
+        weights[row, :selected.size] = area[selected] / area[selected].sum()
+    return cells, weights
+
+
+# weighted mean of flattened maps (..., cell) at every location of an index (cells, weights), as (..., location).
+# Slots with weight 0 (padding, or a bilinear corner that isn't used) are skipped, so a missing value there doesn't make
+# the location NaN; locations with NaN weights (outside the grid, no cells) stay NaN
+def weighted_mean(values, cells, weights):
+    with np.errstate(invalid="ignore"):
+        return np.sum(np.where(weights == 0, 0, values[..., cells] * weights), axis=-1)
+
+
+# bounding boxes (lon_min, lon_max, lat_min, lat_max), averaged over the grid cells with their centre inside
+def boxes(bounds, names=None):
+    bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+
+    def make_index(lon_axis, lat_axis):
+        lon, lat = np.meshgrid(lon_axis, lat_axis)
+        masks = [((lon >= box[0]) & (lon <= box[1]) & (lat >= box[2]) & (lat <= box[3])).ravel() for box in bounds]
+        return mask_index(masks, lat_axis)
+
+    if names is None:
+        names = ["box {:g}..{:g}E {:g}..{:g}N".format(*box) for box in bounds]
+    return locations(make_index, names, ("boxes", bounds.tobytes()))
+
+
+# countries (names as in the shape file, e.g. "Netherlands"), averaged over the grid cells with their centre inside
+def countries(country_names):
+    country_names = list(country_names)
+
+    def make_index(lon_axis, lat_axis):
+        shapes = {}
+        for record in shpreader.Reader(shape_file).records():
+            name = record.attributes['NAME_ENGL'].split("\x00")[0]
+            if name in country_names:
+                shapes[name] = record.geometry
+        lon, lat = np.meshgrid(lon_axis, lat_axis)
+        masks = []
+        for name in country_names:
+            if name not in shapes:
+                raise KeyError("Country " + name + " is not in the shape file")
+            masks.append(shapely.contains_xy(shapes[name], lon.ravel(), lat.ravel()))
+        return mask_index(masks, lat_axis)
+
+    return locations(make_index, country_names, ("countries", tuple(country_names)))
+
+
+# time series of a variable in one file at the given locations, as an array (time, location) or (time, lev, location)
+# if level is None and the variable has levels. level is a lev value (nearest level is used)
+def read_series(filename, variable, where, level=None):
+    cells, weights = where["index"](*grid_axes(filename))
+
+    with netcdf_dataset(filename) as ds:
+        var = ds.variables[variable]
+        dims = list(var.dimensions)
+        key = [slice(None)] * var.ndim
+        if "lev" in dims and level is not None:
+            lev = ds.variables["lev"][:]
+            key[dims.index("lev")] = int(np.argmin(np.abs(lev - level)))
+            del dims[dims.index("lev")]
+
+        if "time" not in dims:
+            blocks = [tuple(key)]
+        else:
+            blocks = []
+            for start in range(0, var.shape[var.dimensions.index("time")], time_block):
+                key[var.dimensions.index("time")] = slice(start, start + time_block)
+                blocks.append(tuple(key))
+
+        series = []
+        for block in blocks:
+            values = np.ma.filled(var[block].astype(np.float64), np.nan)
+            values = values.reshape(values.shape[:-2] + (-1,))  # flatten the lat/lon map
+            series.append(weighted_mean(values, cells, weights))
+    series = np.concatenate(series) if "time" in dims else series[0]
+    return series, dims[:-2]
+
+
+# time series of a variable in several files at the given locations, as a DataArray with dimensions (file, time,
+# location), plus lev if no level is selected. The files need the same number of time steps; the time coordinate is
+# taken from the first file
+def query(filenames, variable, where, level=None):
+    filenames = [filenames] if isinstance(filenames, str) else list(filenames)
+    series = [read_series(filename, variable, where, level) for filename in filenames]
+    dims = ["file"] + series[0][1] + ["location"]
+
+    coords = {"file": [os.path.basename(filename) for filename in filenames], "location": where["names"]}
+    with xr.open_dataset(filenames[0]) as DS:
+        for dim in series[0][1]:
+            coords[dim] = DS[dim].values
+    return xr.DataArray(np.stack([values for values, _ in series]), dims=dims, coords=coords, name=variable)
+
+
+# time series for an ON/OFF pair (ON file, OFF file), as a DataArray with the files "ON", "OFF" and "DELTA" (ON - OFF)
+def query_pair(pair, variable, where, level=None):
+    result = query(pair, variable, where, level)
+    values = np.concatenate((result.values, result.values[:1] - result.values[1:2]))
+    coords = dict(result.coords, file=["ON", "OFF", "DELTA"])
+    return xr.DataArray(values, dims=result.dims, coords=coords, name=variable)
+
+
+if __name__ == "__main__":
+    from matplotlib import pyplot as plt
+    from catalog import load_catalog, resolve_pair
+
+    catalog = load_catalog()
+    schiphol = points([4.76], [52.31], names=["Schiphol"])
+    series = query_pair(resolve_pair(catalog, "O3", "1h", "JAN"), "SpeciesConc_O3", schiphol)
+
+    fig, (ax_abs, ax_delta) = plt.subplots(2, 1, sharex=True, figsize=(10, 6))
+    for switch in ("ON", "OFF"):
+        ax_abs.plot(series.time, series.sel(file=switch, location="Schiphol"), label=switch)
+    ax_abs.legend()
+    ax_abs.set_ylabel("O3")
+    ax_delta.plot(series.time, series.sel(file="DELTA", location="Schiphol"))
+    ax_delta.set_ylabel("O3 ON - OFF")
+    ax_abs.set_title("Schiphol, January")
+    plt.show()
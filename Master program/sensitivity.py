@@ -0,0 +1,167 @@
+import xarray as xr
+import numpy as np
+from parallel_stats import time_mean
+from point_query import grid_axes
+
+"""
+Sensitivity of the aviation-attributable ground-level concentration (ON - OFF, mean over time) to the aircraft
+emissions of altitude bands (AvEmFluxes.nc4, e.g. LTO, climb/descent and cruise):
+
+    delta = intercept + sum over bands of coefficient[band] * emission[band]
+
+The emissions have no time dimension, so the samples of a regression are grid cells:
+    - per grid cell: all cells in a (2 * radius + 1) x (2 * radius + 1) window around it (a local regression)
+    - per location (countries, boxes from point_query): all cells of the location, weighted with their area
+All regressions are solved at once from their normal equations. For the grid cells, the sums of the products of the
+predictors in every window come from a 2D cumulative sum (a summed-area table), so the cost doesn't depend on the
+window size. The emissions are scaled to unit standard deviation before solving to keep the equations well
+conditioned; the results are in the units of the data (concentration per kg/m2/s).
+
+The result has the coefficient and its standard error per band, the intercept, R2 and the number of samples. The
+results per location are in the same Dataset, prefixed with location_ over the dimension location.
+Regressions where a band has (next to) no emissions in the samples, or with too few samples, can't be solved and are
+NaN.
+"""
+
+emission_filename = "../Data/AvEmFluxes.nc4"
+bands = {"LTO": (0, 1), "climb": (1, 9), "cruise": (9, 20)}  # altitude ranges in km of the emission levels
+radius = 3  # half width of the window of the grid cell regressions, in grid cells
+
+
+# the emissions of a variable summed over the levels of every altitude band, as a DataArray (band, lat, lon)
+def band_emissions(variable="BC", filename=emission_filename):
+    altitudes = np.genfromtxt("Altitude_levels.txt", skip_header=3, usecols=(0, 2))
+    level_altitude = dict(zip(altitudes[:, 0].astype(int), altitudes[:, 1]))
+    with xr.open_dataset(filename) as DS:
+        da = DS[variable].load()
+    heights = np.array([level_altitude[int(lev)] for lev in da.lev.values])
+    summed = [da.isel(lev=np.flatnonzero((heights >= low) & (heights < high))).sum("lev")
+              for low, high in bands.values()]
+    return xr.concat(summed, dim="band").assign_coords(band=list(bands)).astype(np.float64)
+
+
+# ground-level ON - OFF of a variable, averaged over time, on the grid of the emissions
+def ground_delta(on_filename, off_filename, variable, emissions):
+    delta = time_mean(on_filename, variable, off_filename)
+    if "lev" in delta.dims:
+        delta = delta.isel(lev=0)
+    return delta.sel(lat=emissions.lat, lon=emissions.lon, method="nearest")
+
+
+# sum of the values (..., lat, lon) in a window of radius cells around every cell, cut off at the edges of the grid
+def window_sum(values, radius):
+    total = np.cumsum(np.cumsum(values, axis=-2), axis=-1)
+    total = np.pad(total, [(0, 0)] * (values.ndim - 2) + [(1, 0), (1, 0)], mode="constant")
+    n_lat, n_lon = values.shape[-2:]
+    low_i = np.clip(np.arange(n_lat) - radius, 0, n_lat)[:, np.newaxis]
+    high_i = np.clip(np.arange(n_lat) + radius + 1, 0, n_lat)[:, np.newaxis]
+    low_j = np.clip(np.arange(n_lon) - radius, 0, n_lon)
+    high_j = np.clip(np.arange(n_lon) + radius + 1, 0, n_lon)
+    return total[..., high_i, high_j] - total[..., low_i, high_j] - total[..., high_i, low_j] + total[..., low_i, low_j]
+
+
+# solve a stack of regressions from their normal equations: xx (..., q, q) and xy (..., q) the weighted sums of the
+# products of the predictors (the first one is the intercept), yy the weighted sum of y ** 2 and n the number of
+# samples. Predictors with a sum of squares up to floor count as missing. Returns the coefficients, their standard
+# errors, R2 and a mask of the solvable regressions
+def solve_normal(xx, xy, yy, n, floor=0):
+    q = xx.shape[-1]
+    diagonal = np.diagonal(xx, axis1=-2, axis2=-1)
+    solvable = np.all(diagonal > floor, axis=-1) & (n > q)
+    # the rank of the correlation matrix, so that the tolerance doesn't depend on the size of the predictors
+    norm = np.sqrt(np.where(solvable[..., np.newaxis], diagonal, 1))
+    correlation = xx / (norm[..., np.newaxis] * norm[..., np.newaxis, :])
+    solvable &= np.linalg.matrix_rank(correlation, tol=1E-8) == q
+    identity = np.eye(q)
+    xx = np.where(solvable[..., np.newaxis, np.newaxis], xx, identity)  # placeholder for the unsolvable ones
+    inverse = np.linalg.inv(xx)
+    coef = np.einsum("...ij,...j->...i", inverse, xy)
+
+    residual = np.maximum(yy - np.einsum("...i,...i->...", coef, xy), 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        total = yy - xy[..., 0] ** 2 / n  # the sum of the first predictor (ones) times y is the sum of y
+        r2 = 1 - residual / total
+        variance = residual / (n - q)
+        std_error = np.sqrt(variance[..., np.newaxis] * np.diagonal(inverse, axis1=-2, axis2=-1))
+
+    nan = np.where(solvable, 1.0, np.nan)
+    return coef * nan[..., np.newaxis], std_error * nan[..., np.newaxis], r2 * nan, solvable
+
+
+# the results of solve_normal as a Dataset, with the coefficients scaled back to the units of the emissions
+def result_dataset(coef, std_error, r2, n, scale, dims, coords):
+    return xr.Dataset({"coefficient": (["band"] + dims, np.moveaxis(coef[..., 1:] / scale, -1, 0)),
+                       "std_error": (["band"] + dims, np.moveaxis(std_error[..., 1:] / scale, -1, 0)),
+                       "intercept": (dims, coef[..., 0]), "intercept_std_error": (dims, std_error[..., 0]),
+                       "r2": (dims, r2), "samples": (dims, n)},
+                      coords=dict(coords, band=list(bands)))
+
+
+# regressions of the ground-level ON - OFF of variable on the band emissions of emission_variable. Returns a Dataset
+# with the results per grid cell (over lat, lon of the emission grid) and, if where (from point_query) is given, the
+# results per location (location_<name> over location)
+def sensitivity(on_filename, off_filename, variable, emission_variable="BC", where=None, window=radius):
+    emissions = band_emissions(emission_variable)
+    delta = ground_delta(on_filename, off_filename, variable, emissions).values
+    valid = ~np.isnan(delta) & ~np.isnan(emissions.values).any(axis=0)
+
+    # predictors (q, lat, lon): ones for the intercept and the scaled emissions of every band
+    scale = np.nanstd(emissions.values.reshape(len(bands), -1), axis=1)
+    scale[scale == 0] = 1
+    x = np.concatenate((np.ones((1,) + delta.shape), emissions.values / scale[:, np.newaxis, np.newaxis]))
+    x = np.where(valid, x, 0)
+    y = np.where(valid, delta, 0)
+
+    xx = window_sum(x[:, np.newaxis] * x[np.newaxis], window)
+    xy = window_sum(x * y, window)
+    n = window_sum(valid.astype(float), window)
+    # the window sums are differences of large cumulative sums, so anything below this floor is rounding noise
+    floor = 1E-12 * np.sum(x ** 2, axis=(1, 2))
+    coef, std_error, r2, _ = solve_normal(np.moveaxis(xx, (0, 1), (-2, -1)), np.moveaxis(xy, 0, -1),
+                                          window_sum(y ** 2, window), n, floor)
+    coords = {"lat": emissions.lat.values, "lon": emissions.lon.values}
+    cells = result_dataset(coef, std_error, r2, n, scale, ["lat", "lon"], coords)
+    cells.attrs.update(variable=variable, emission_variable=emission_variable, window=2 * window + 1)
+    if where is None:
+        return cells
+
+    # per location: weighted least squares over the cells of the location, with weights that add up to the number of
+    # cells. Missing cells get weight 0
+    index, weights = where["index"](*grid_axes(emission_filename))
+    weights = np.where(np.isnan(weights) | ~valid.ravel()[index], 0, weights)
+    n = np.count_nonzero(weights, axis=1).astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weights = weights * (n / weights.sum(axis=1))[:, np.newaxis]
+    weights = np.nan_to_num(weights)
+    x_loc = x.reshape(len(x), -1)[:, index]  # (q, location, cell)
+    y_loc = y.ravel()[index]
+    xx = np.einsum("ilk,jlk,lk->lij", x_loc, x_loc, weights)
+    xy = np.einsum("ilk,lk,lk->li", x_loc, y_loc, weights)
+    yy = np.einsum("lk,lk,lk->l", y_loc, y_loc, weights)
+    coef, std_error, r2, _ = solve_normal(xx, xy, yy, n)
+    locations = result_dataset(coef, std_error, r2, n, scale, ["location"], {"location": where["names"]})
+    return cells.merge(locations.rename({name: "location_" + name for name in locations.data_vars}))
+
+
+if __name__ == "__main__":
+    from matplotlib import pyplot as plt
+    import cartopy.crs as ccrs
+    from point_query import countries
+
+    on, off = "../Data/PM25.1h.JUL.ON.nc4", "../Data/PM25.1h.JUL.OFF.nc4"
+    names = ["France", "Germany", "Italy", "Netherlands", "Spain", "United Kingdom"]
+    cells = sensitivity(on, off, "PM25", "BC", countries(names))
+    print(cells[["location_coefficient", "location_std_error"]].to_dataframe().unstack("band"))
+    print(cells[["location_r2", "location_samples"]].to_dataframe())
+
+    fig = plt.figure(figsize=(16, 8))
+    for i, band in enumerate(list(bands) + ["r2"]):
+        ax = fig.add_subplot(2, 2, i + 1, projection=ccrs.PlateCarree())
+        ax.coastlines(resolution='50m')
+        if band == "r2":
+            cells.r2.plot(ax=ax, vmin=0, vmax=1, cmap="viridis")
+            ax.set_title("R2")
+        else:
+            cells.coefficient.sel(band=band).plot(ax=ax, robust=True, cmap="coolwarm")
+            ax.set_title("Sensitivity of ground PM2.5 to " + band + " BC emissions")
+    plt.show()
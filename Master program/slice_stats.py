@@ -0,0 +1,190 @@
+from netCDF4 import Dataset as netcdf_dataset
+import numpy as np
+import json
+import os
+
+"""
+Statistics of the variables of a data file, computed once and stored in a sidecar file next to it (<file>.stats.json).
+For every variable the sidecar holds the minimum, maximum, mean and the robust percentiles below, for the whole
+variable ("global"), for every level ("per_level") and for every time step ("per_time"). The data is read one time step
+(or level) at a time, so the whole array never has to be in memory. The percentiles over more than one slice come from
+a random sample of fixed size per variable and per level, so the memory doesn't grow with the length of the file.
+
+The plots use color_limits() for vmin/vmax instead of loading and scanning the data, and get the same limits for every
+frame of an animation. Differences ON - OFF get their own sidecar (<ON file>.minus.<OFF file>.stats.json), so the
+delta view has stable limits as well. A sidecar is recomputed when one of its files has been modified.
+"""
+
+percentiles = [1, 5, 50, 95, 99]
+sample_size = 20000  # number of values (per variable and per level) that are kept to estimate the percentiles
+
+
+def stats_filename(filename, off_filename=None):
+    if off_filename is None:
+        return filename + ".stats.json"
+    return filename + ".minus." + os.path.basename(off_filename) + ".stats.json"
+
+
+# min, max, mean and percentiles of the values that are not NaN
+def summary(values):
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return None
+    return {"min": float(values.min()), "max": float(values.max()), "mean": float(values.mean()),
+            "percentiles": np.percentile(values, percentiles).tolist()}
+
+
+# running statistics of values that are added slice by slice: exact min, max and mean, and a uniform random sample of
+# fixed size for the percentiles (reservoir sampling), so the memory doesn't grow with the number of slices
+def new_accumulator():
+    return {"min": np.inf, "max": -np.inf, "total": 0.0, "count": 0, "sample": np.empty(sample_size)}
+
+
+# add the values that are not NaN to an accumulator, in place
+def accumulate(acc, values, rng):
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return
+    acc["min"] = min(acc["min"], float(values.min()))
+    acc["max"] = max(acc["max"], float(values.max()))
+    acc["total"] += float(values.sum())
+
+    # the first sample_size values fill the sample, after that value number t replaces a random element with
+    # probability sample_size / (t + 1)
+    seen = acc["count"]
+    fill = max(0, min(sample_size - seen, values.size))
+    acc["sample"][seen:seen + fill] = values[:fill]
+    rest = values[fill:]
+    slots = rng.integers(0, seen + fill + np.arange(1, rest.size + 1))
+    keep = slots < sample_size
+    acc["sample"][slots[keep]] = rest[keep]
+    acc["count"] = seen + values.size
+
+
+# the statistics of all values added to an accumulator, like summary()
+def finish(acc):
+    if acc["count"] == 0:
+        return None
+    return {"min": acc["min"], "max": acc["max"], "mean": acc["total"] / acc["count"],
+            "percentiles": np.percentile(acc["sample"][:min(acc["count"], sample_size)], percentiles).tolist()}
+
+
+# statistics of one variable with the given dimensions and shape. read(i) returns the values of time step i, or of
+# level i if there is no time dimension, as a float array with NaN for missing values
+def variable_stats(dims, shape, read):
+    rng = np.random.default_rng(0)
+    outer = "time" if "time" in dims else "lev" if "lev" in dims else None
+    inner_dims = [dim for dim in dims if dim != outer]
+    has_levels = "lev" in inner_dims
+
+    per_outer = []
+    total = new_accumulator()
+    levels = [new_accumulator() for _ in range(shape[dims.index("lev")])] if has_levels else []
+    for i in range(shape[dims.index(outer)] if outer else 1):
+        values = read(i)
+        per_outer.append(summary(values))
+        accumulate(total, values, rng)
+        if has_levels:
+            values = np.moveaxis(values, inner_dims.index("lev"), 0)
+            for k, level in enumerate(levels):
+                accumulate(level, values[k], rng)
+
+    result = {"dims": list(dims), "global": finish(total)}
+    if outer == "time":
+        result["per_time"] = per_outer
+    if outer == "lev":
+        result["per_level"] = per_outer
+    elif has_levels:
+        result["per_level"] = [finish(level) for level in levels]
+    return result
+
+
+# the variables of a file for which statistics are kept: everything with at least a lat/lon map
+def data_variables(ds):
+    return [name for name, var in ds.variables.items() if var.ndim >= 2 and name not in ds.dimensions]
+
+
+# the function that reads time step (or level) i of a variable, see variable_stats
+def slice_reader(var, off_var=None):
+    dims = var.dimensions
+    axis = dims.index("time") if "time" in dims else dims.index("lev") if "lev" in dims else None
+
+    def read(i):
+        index = [slice(None)] * len(dims)
+        if axis is not None:
+            index[axis] = i
+        values = np.ma.filled(var[tuple(index)].astype(np.float64), np.nan)
+        if off_var is not None:
+            values = values - np.ma.filled(off_var[tuple(index)].astype(np.float64), np.nan)
+        return values
+
+    return read
+
+
+# compute the statistics of all data variables of a file, or of the difference of two files, and write the sidecar
+def compute_stats(filename, off_filename=None):
+    sources = [filename] if off_filename is None else [filename, off_filename]
+    stats = {"sources": [os.path.basename(source) for source in sources],
+             "mtimes": [os.path.getmtime(source) for source in sources], "percentiles": percentiles, "variables": {}}
+
+    datasets = [netcdf_dataset(source) for source in sources]
+    for name in data_variables(datasets[0]):
+        var = datasets[0].variables[name]
+        if off_filename is None:
+            stats["variables"][name] = variable_stats(var.dimensions, var.shape, slice_reader(var))
+        elif name in datasets[1].variables:
+            stats["variables"][name] = variable_stats(var.dimensions, var.shape,
+                                                      slice_reader(var, datasets[1].variables[name]))
+    for ds in datasets:
+        ds.close()
+
+    with open(stats_filename(filename, off_filename), "w") as outfile:
+        json.dump(stats, outfile)
+    return stats
+
+
+# load the statistics of a file (or of the difference ON - OFF), computing them first if there is no sidecar yet or if
+# a file has changed since
+def load_stats(filename, off_filename=None):
+    sources = [filename] if off_filename is None else [filename, off_filename]
+    try:
+        with open(stats_filename(filename, off_filename)) as infile:
+            stats = json.load(infile)
+        if stats["mtimes"] == [os.path.getmtime(source) for source in sources]:
+            return stats
+    except FileNotFoundError:
+        pass
+    return compute_stats(filename, off_filename)
+
+
+# colour limits (vmin, vmax) of a variable, for the whole file or for a level index. With robust set, the 1st and 99th
+# percentile are used instead of the minimum and maximum, so a few extreme cells don't wash out the map. When an OFF
+# file is given, the limits are those of ON - OFF
+def color_limits(filename, variable, level=None, off_filename=None, robust=False):
+    var_stats = load_stats(filename, off_filename)["variables"][variable]
+    stats = var_stats["global"]
+    if level is not None and "per_level" in var_stats:
+        stats = var_stats["per_level"][level]
+    if stats is None:
+        return None, None
+    if robust:
+        return stats["percentiles"][0], stats["percentiles"][-1]
+    return stats["min"], stats["max"]
+
+
+# colour limits for a DataArray opened with xarray from one of the data files, optionally minus the same variable of
+# an OFF file. level is the lev value that is selected (nearest), or None/0 for all levels
+def data_array_limits(da, da_off=None, level=None, robust=False):
+    level_index = None
+    if level and "lev" in da.dims:
+        level_index = int(np.argmin(np.abs(da.lev.values - level)))
+    off_filename = None if da_off is None else da_off.encoding["source"]
+    return color_limits(da.encoding["source"], da.name, level_index, off_filename, robust)
+
+
+if __name__ == "__main__":
+    import glob
+    for filename in sorted(glob.glob("../Data/*.nc4")):
+        print("Statistics of", os.path.basename(filename), "...")
+        load_stats(filename)
+    print("Finished")
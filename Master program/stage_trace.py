@@ -0,0 +1,179 @@
+from contextlib import contextmanager
+from functools import wraps
+import threading
+import json
+import time
+import csv
+import os
+
+try:
+    import psutil
+except ImportError:  # without psutil only the times and the peak memory of the whole process are recorded
+    psutil = None
+    try:
+        import resource
+    except ImportError:  # Windows
+        resource = None
+
+"""
+Timing and memory measurements of the stages of a program. A stage is measured with
+
+    with span("Creating country polygons"):
+        ...
+
+or by decorating a function with @traced(). For every span the trace records the wall time, the CPU time, the peak
+resident memory (RSS) of the process during the span and the number of bytes that the process read while it ran
+(including files read from the disk cache). Spans can be nested; the trace keeps the depth and the parent of every
+span. Repeated spans with the same name, depth and parent (e.g. the frames of an animation) are kept as one record with
+the number of calls, the total and the longest wall time, the total CPU time and bytes read and the highest peak
+memory, so the trace doesn't grow while an animation loops. write_trace() writes the spans as JSON or CSV (depending on
+the file extension), and print_trace() shows them as a table.
+
+The peak memory is sampled by a single background thread every sample_interval seconds while a span is open (it waits
+while there is none), so very short peaks can be missed. The memory and bytes read need psutil; without it, only the
+peak memory of the whole process so far is recorded (not on Windows), and bytes read are left empty.
+"""
+
+enabled = True  # set to False to switch off all measurements
+sample_interval = 0.01  # seconds between two memory samples
+
+spans = []  # the records of the spans, in the order in which they were first started
+_records = {}  # (depth, parent, name): record in spans
+_open = []  # stack of the spans that are running
+_sampler = {"thread": None, "condition": threading.Condition()}
+
+
+def rss():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if resource is not None:
+        # ru_maxrss is the peak of the whole process, in kB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def bytes_read():
+    if psutil is None:
+        return None
+    try:
+        counters = psutil.Process().io_counters()
+    except (AttributeError, psutil.Error):  # not available on macOS
+        return None
+    return getattr(counters, "read_chars", counters.read_bytes)
+
+
+# background thread that keeps the peak memory of all open spans up to date, and sleeps while no span is open
+def sample_memory():
+    condition = _sampler["condition"]
+    while True:
+        with condition:
+            while not _open:
+                condition.wait()
+            memory = rss()
+            for current in _open:
+                current["peak_rss"] = max(current["peak_rss"], memory)
+        time.sleep(sample_interval)
+
+
+# the record of a span that is started, created the first time the span runs
+def _record(current):
+    key = (current["depth"], current["parent"], current["name"])
+    if key not in _records:
+        _records[key] = {"name": current["name"], "depth": current["depth"], "parent": current["parent"],
+                         "start": current["start"], "calls": 0, "wall": 0.0, "max_wall": 0.0, "cpu": 0.0,
+                         "peak_rss": None, "bytes_read": None}
+        spans.append(_records[key])
+    return _records[key]
+
+
+# add a finished call of a span to its record
+def _finish(record, current, info):
+    record.update(info)
+    record["calls"] += 1
+    record["wall"] += current["wall"]
+    record["max_wall"] = max(record["max_wall"], current["wall"])
+    record["cpu"] += current["cpu"]
+    if current["peak_rss"] is not None:
+        record["peak_rss"] = max(record["peak_rss"] or 0, current["peak_rss"])
+    if current["bytes_read"] is not None:
+        record["bytes_read"] = (record["bytes_read"] or 0) + current["bytes_read"]
+
+
+@contextmanager
+def span(name, **info):
+    if not enabled:
+        yield None
+        return
+
+    memory = rss()
+    current = {"name": name, "depth": len(_open), "parent": _open[-1]["name"] if _open else None,
+               "start": time.time(), "peak_rss": memory}
+    record = _record(current)
+    start_read = bytes_read()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+
+    condition = _sampler["condition"]
+    with condition:
+        _open.append(current)
+        if memory is not None and _sampler["thread"] is None:
+            _sampler["thread"] = threading.Thread(target=sample_memory, daemon=True)
+            _sampler["thread"].start()
+        condition.notify()
+    try:
+        yield current
+    finally:
+        current["wall"] = time.perf_counter() - start_wall
+        current["cpu"] = time.process_time() - start_cpu
+        end_read = bytes_read()
+        current["bytes_read"] = None if start_read is None else end_read - start_read
+        with condition:
+            _open.remove(current)
+            if memory is not None:
+                current["peak_rss"] = max(current["peak_rss"], rss())
+            _finish(record, current, info)
+
+
+# decorator that measures every call of a function as a span, named after the function unless a name is given
+def traced(name=None):
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+columns = ["name", "depth", "parent", "start", "calls", "wall", "max_wall", "cpu", "peak_rss", "bytes_read"]
+
+
+# write the finished spans to a .json or .csv file
+def write_trace(filename):
+    finished = [record for record in spans if record["calls"] > 0]
+    if os.path.splitext(filename)[1] == ".csv":
+        with open(filename, "w", newline="") as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=columns, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(finished)
+    else:
+        with open(filename, "w") as outfile:
+            json.dump(finished, outfile, indent=4)
+
+
+# show the finished spans as a table
+def print_trace():
+    print("{:<40}{:>7}{:>11}{:>11}{:>11}{:>13}{:>13}".format("stage", "calls", "wall [s]", "max [s]", "cpu [s]",
+                                                             "peak [MB]", "read [MB]"))
+    for record in spans:
+        if record["calls"] == 0:
+            continue
+        print("{:<40}{:>7}{:>11.3f}{:>11.3f}{:>11.3f}{:>13.1f}{:>13.1f}".format(
+            ("  " * record["depth"] + record["name"])[:39], record["calls"], record["wall"], record["max_wall"],
+            record["cpu"], (record["peak_rss"] or 0) / 1E6, (record["bytes_read"] or 0) / 1E6))
+
+
+# forget all spans
+def clear_trace():
+    del spans[:]
+    _records.clear()
@@ -0,0 +1,120 @@
+import xarray as xr
+import numpy as np
+import json
+import glob
+import os
+
+"""
+Cache of single model levels, mostly the ground level. Almost every analysis only looks at the lowest level
+(sel(lev=1, method='nearest')), but has to open the full 72-level arrays to get it. The first time a file is used, the
+named levels below are extracted for every variable that has a lev dimension and saved as float32 .npy files in
+cache_dir. Later calls memory-map these small arrays instead.
+
+A cache is rebuilt automatically when the size or modification time of its source file changes.
+"""
+
+cache_dir = "../Data/surface/"
+
+# levels that are extracted, as "name: lev value". The level closest to the value is used, so 1 gives the ground
+# level both for files with eta values (0.9925) and with level numbers (1)
+named_levels = {"ground": 1}
+
+time_block = 24  # number of time steps read at once while building the cache
+
+
+def cache_prefix(filename):
+    return os.path.join(cache_dir, os.path.basename(filename).replace(".nc4", ""))
+
+
+# size and modification time of a file, used to check whether the cache is still up to date
+def source_signature(filename):
+    return [os.path.getsize(filename), os.path.getmtime(filename)]
+
+
+# extract the named levels of every variable of a file and write them to the cache
+def build_cache(filename, levels=named_levels):
+    os.makedirs(cache_dir, exist_ok=True)
+    prefix = cache_prefix(filename)
+    DS = xr.open_dataset(filename)
+
+    info = {"source": filename, "signature": source_signature(filename), "variables": [], "levels": {}}
+    if "lev" in DS.dims:
+        lev_values = DS.lev.values
+        for name, value in levels.items():
+            index = int(np.argmin(np.abs(lev_values - value)))
+            info["levels"][name] = {"index": index, "lev": float(lev_values[index])}
+
+    for variable in DS.data_vars:
+        da = DS[variable]
+        if "lev" not in da.dims:
+            continue
+        info["variables"].append(variable)
+        for name, level in info["levels"].items():
+            da_lev = da.isel(lev=level["index"])
+            out = np.lib.format.open_memmap("{}.{}.{}.npy".format(prefix, variable, name), mode="w+",
+                                            dtype=np.float32, shape=da_lev.shape)
+            if "time" in da_lev.dims:
+                axis = da_lev.dims.index("time")
+                for start in range(0, da_lev.time.size, time_block):
+                    block = da_lev.isel(time=slice(start, start + time_block)).values
+                    index = [slice(None)] * da_lev.ndim
+                    index[axis] = slice(start, start + block.shape[axis])
+                    out[tuple(index)] = block
+            else:
+                out[...] = da_lev.values
+            out.flush()
+
+    # the coordinates of the extracted arrays, to be able to return them as DataArrays again
+    coords = {name: DS[name].values for name in DS.coords if name != "lev" and DS[name].ndim == 1}
+    np.savez(prefix + ".coords.npz", **coords)
+    info["dims"] = {variable: [dim for dim in DS[variable].dims if dim != "lev"] for variable in info["variables"]}
+
+    with open(prefix + ".json", "w") as outfile:
+        json.dump(info, outfile, indent=4)
+    DS.close()
+
+
+# load the description of the cache of a file, or None if there is no up-to-date cache
+def cache_info(filename):
+    try:
+        with open(cache_prefix(filename) + ".json") as infile:
+            info = json.load(infile)
+    except FileNotFoundError:
+        return None
+    if info["signature"] != source_signature(filename):
+        return None
+    return info
+
+
+# one level of a variable as a DataArray with the original coordinates (except lev). The values are memory-mapped
+# from the cache, which is built first if necessary
+def cached_level(filename, variable, level="ground"):
+    if level not in named_levels:
+        raise KeyError("Unknown level " + level + ", add it to named_levels first")
+    info = cache_info(filename)
+    if info is None or level not in info["levels"]:
+        build_cache(filename)
+        info = cache_info(filename)
+    if variable not in info["variables"]:
+        raise KeyError("Variable " + variable + " has no lev dimension in " + filename)
+
+    prefix = cache_prefix(filename)
+    values = np.load("{}.{}.{}.npy".format(prefix, variable, level), mmap_mode="r")
+    with np.load(prefix + ".coords.npz") as coords:
+        dims = info["dims"][variable]
+        da = xr.DataArray(values, dims=dims, coords={dim: coords[dim] for dim in dims if dim in coords.files},
+                          name=variable)
+    return da.assign_coords(lev=info["levels"][level]["lev"])
+
+
+# the ground level of a variable (see cached_level)
+def ground_level(filename, variable):
+    return cached_level(filename, variable, "ground")
+
+
+if __name__ == "__main__":
+    for filename in sorted(glob.glob("../Data/*.nc4")):
+        if cache_info(filename) is None:
+            print("Extracting levels of", os.path.basename(filename), "...")
+            build_cache(filename)
+    print("Finished")
@@ -0,0 +1,249 @@
+from netCDF4 import Dataset as netcdf_dataset
+import numpy as np
+import argparse
+import os
+
+"""
+Generator of synthetic data files with the same variables, dimensions, coordinates and attributes as the simulation
+results, to test how the programs scale with file size without having to copy full runs around. Available species:
+
+    Soot        AerMassBC (time, lev, lat, lon), daily, all levels          Soot.24h.<month>.<ON|OFF>.nc4
+    Aerosol     PM25 (time, lev, lat, lon), daily, all levels               Aerosol.24h.<month>.<ON|OFF>.nc4
+    PM25        PM25 (time, lat, lon), hourly, ground level (scalar lev)    PM25.1h.<month>.<ON|OFF>.nc4
+    O3          SpeciesConc_O3 (time, lat, lon), hourly, ground level       O3.1h.<month>.<ON|OFF>.nc4
+    AvEmFluxes  FUELBURN, NO2, HC, CO, BC (lev, lat, lon), no time           AvEmFluxes.nc4
+
+The grid (region and resolution), the number of levels and time steps and the data type can be chosen freely. The
+eta values of the levels come from Altitude_levels.txt (interpolated if a different number of levels is asked for).
+The values are smooth fields with a bit of noise and the right order of magnitude; files with aircraft ON get an
+extra contribution that is largest along a band of flight routes and at cruise altitude, so ON - OFF looks like an
+aviation signal. Data is generated and written in blocks of at most block_bytes, so files of tens of GB can be made
+with little memory. The same settings always give the same values.
+
+Usage: python synthetic_data.py Soot --lat-res 0.25 --lon-res 0.3125 --times 31 [--region global] [--dtype float64]
+"""
+
+output_dir = "../Data/synthetic/"
+level_file = "Altitude_levels.txt"
+
+# lon_min, lon_max, lat_min, lat_max of the regions. "europe" is the grid of the simulation results
+regions = {"europe": (-30, 50, 30, 70), "global": (-180, 179.375, -90, 90)}
+lat_res = 0.5
+lon_res = 0.625
+
+months = {"JAN": "2005-01", "JUL": "2005-07"}
+block_bytes = 256 * 1024 ** 2  # maximum size of the data generated at once
+
+# name of the variable, dimensions, long name, units, typical ground value of OFF, frequency, first time step
+species = {
+    "Soot": {"variable": "AerMassBC", "levels": True, "long_name": "Mass concentration of black carbon aerosol",
+             "units": "ug m-3", "value": 0.3, "freq": "24h", "start": "-11T00:00:00"},
+    "Aerosol": {"variable": "PM25", "levels": True, "long_name": "Particulate matter with radii < 2.5 um",
+                "units": "ug m-3", "value": 12.0, "freq": "24h", "start": "-11T00:00:00"},
+    "PM25": {"variable": "PM25", "levels": False, "long_name": "Particulate matter with radii < 2.5 um",
+             "units": "ug m-3", "value": 12.0, "freq": "1h", "start": "-20T00:30:00"},
+    "O3": {"variable": "SpeciesConc_O3", "levels": False, "long_name": "Dry mixing ratio of species O3",
+           "units": "mol mol-1 dry", "value": 3.5E-8, "freq": "1h", "start": "-20T00:30:00"},
+}
+
+emissions = {"FUELBURN": "AEIC aircraft fuel burned", "NO2": "AEIC aircraft emitted NOx (NO2 base)",
+             "HC": "AEIC aircraft emitted hydrocarbons (CH4 base)", "CO": "AEIC aircraft emitted CO",
+             "BC": "AEIC aircraft emitted black carbon"}
+emission_scale = {"FUELBURN": 1E-9, "NO2": 1.4E-11, "HC": 5E-13, "CO": 3E-12, "BC": 3E-14}  # kg/m2/s at the peak
+
+
+# longitude and latitude axes of a region with the given resolution
+def grid(region="europe", lat_step=lat_res, lon_step=lon_res):
+    lon_min, lon_max, lat_min, lat_max = regions[region]
+    lon = np.arange(lon_min, lon_max + lon_step / 2, lon_step)
+    lat = np.arange(lat_min, lat_max + lat_step / 2, lat_step)
+    return lon, lat
+
+
+# eta values at the level midpoints, from the ground up. With a different number of levels than in the level table,
+# the eta values are interpolated over the table
+def eta_levels(n_levels=72):
+    eta = np.genfromtxt(level_file, skip_header=3, usecols=(1,))[::-1]
+    if n_levels == len(eta):
+        return eta
+    return np.interp(np.linspace(0, len(eta) - 1, n_levels), np.arange(len(eta)), eta)
+
+
+# approximate size of a file in bytes
+def file_size(name, lon, lat, n_levels, n_times, dtype):
+    itemsize = np.dtype(dtype).itemsize
+    if name == "AvEmFluxes":
+        return len(emissions) * n_levels * len(lat) * len(lon) * itemsize
+    return n_times * (n_levels if species[name]["levels"] else 1) * len(lat) * len(lon) * itemsize
+
+
+# horizontal pattern (lat, lon) between 0 and 1: smooth blobs, highest over central Europe
+def horizontal_pattern(lon, lat):
+    lon2d, lat2d = np.meshgrid(np.radians(lon), np.radians(lat))
+    pattern = 0.5 + 0.25 * np.sin(3 * lon2d + 1) * np.cos(4 * lat2d) + 0.25 * np.cos(2 * lon2d - 0.5) ** 2
+    return pattern.astype(np.float32)
+
+
+# band of flight routes (lat, lon) between 0 and 1, e.g. for emissions and the aircraft contribution
+def route_pattern(lon, lat):
+    lon2d, lat2d = np.meshgrid(lon, lat)
+    return np.exp(-((lat2d - 50 - 5 * np.sin(np.radians(lon2d) * 4)) / 4) ** 2).astype(np.float32)
+
+
+# vertical profile of the aircraft contribution: a peak at cruise altitude (eta around 0.25) and a smaller one at the
+# ground (landing and take-off)
+def aircraft_profile(eta):
+    return np.exp(-((eta - 0.25) / 0.08) ** 2) + 0.3 * np.exp(-((1 - eta) / 0.03) ** 2)
+
+
+# create an empty file with the dimensions and coordinate variables
+def create_file(filename, lon, lat, eta, times, time_units, levels, dtype):
+    ds = netcdf_dataset(filename, "w", format="NETCDF4")
+    ds.createDimension("time", None)
+    if levels:
+        ds.createDimension("lev", len(eta))
+    ds.createDimension("lat", len(lat))
+    ds.createDimension("lon", len(lon))
+
+    var = ds.createVariable("time", np.int64, ("time",))
+    var.setncatts({"long_name": "Time", "axis": "T", "units": time_units, "calendar": "proleptic_gregorian"})
+    var[:] = times
+
+    var = ds.createVariable("lev", np.float64, ("lev",) if levels else (), fill_value=np.nan)
+    var.setncatts({"long_name": "hybrid level at midpoints ((A/P0)+B)", "units": "level", "axis": "Z",
+                   "positive": "up", "standard_name": "atmosphere_hybrid_sigma_pressure_coordinate",
+                   "formula_terms": "a: hyam b: hybm p0: P0 ps: PS"})
+    var[...] = eta if levels else eta[0]
+
+    for name, values, long_name, units, axis in (("lat", lat, "Latitude", "degrees_north", "Y"),
+                                                 ("lon", lon, "Longitude", "degrees_east", "X")):
+        var = ds.createVariable(name, np.float64, (name,), fill_value=np.nan)
+        var.setncatts({"long_name": long_name, "units": units, "axis": axis})
+        var[:] = values
+    return ds
+
+
+# write a concentration file of one of the species, for aircraft on or off. Returns the file name
+def generate_species(name, month="JAN", switch="ON", region="europe", lat_step=lat_res, lon_step=lon_res,
+                     n_levels=72, n_times=None, dtype=np.float32, compression=0):
+    settings = species[name]
+    lon, lat = grid(region, lat_step, lon_step)
+    eta = eta_levels(n_levels) if settings["levels"] else eta_levels()[:1]
+    if n_times is None:
+        n_times = 21 if settings["freq"] == "24h" else 72
+    unit = "days" if settings["freq"] == "24h" else "hours"
+    time_units = unit + " since " + months[month] + settings["start"].replace("T", " ")
+
+    os.makedirs(output_dir, exist_ok=True)
+    filename = os.path.join(output_dir, ".".join((name, settings["freq"], month, switch, "nc4")))
+    ds = create_file(filename, lon, lat, eta, np.arange(n_times), time_units, settings["levels"], dtype)
+
+    dims = ("time", "lev", "lat", "lon") if settings["levels"] else ("time", "lat", "lon")
+    map_shape = (len(eta), len(lat), len(lon)) if settings["levels"] else (len(lat), len(lon))
+    chunks = [1] + list(map_shape)
+    if settings["levels"]:
+        chunks[1] = 1
+    var = ds.createVariable(settings["variable"], dtype, dims, fill_value=np.array(np.nan, dtype=dtype),
+                            zlib=compression > 0, complevel=max(compression, 1), chunksizes=chunks)
+    var.setncatts({"long_name": settings["long_name"], "units": settings["units"], "averaging_method": "time-averaged"})
+    if not settings["levels"]:
+        var.setncattr("coordinates", "lev")
+
+    # the parts of the field that don't change in time
+    pattern = horizontal_pattern(lon, lat) * settings["value"]
+    aircraft = route_pattern(lon, lat) * settings["value"] * (0.02 if switch == "ON" else 0)
+    if settings["levels"]:
+        decay = eta.astype(np.float32)[:, np.newaxis, np.newaxis] ** 2  # concentrations drop with height
+        profile = aircraft_profile(eta).astype(np.float32)[:, np.newaxis, np.newaxis]
+        pattern = pattern * decay
+        aircraft = aircraft * profile
+
+    steps_per_day = 1 if settings["freq"] == "24h" else 24
+    time_block = max(1, block_bytes // (int(np.prod(map_shape)) * np.dtype(dtype).itemsize))
+    for start in range(0, n_times, time_block):
+        stop = min(start + time_block, n_times)
+        rng = np.random.default_rng([start, len(lon), len(lat), len(eta)])
+        block = np.empty((stop - start,) + map_shape, dtype=dtype)
+        for k in range(stop - start):
+            phase = 2 * np.pi * (start + k) / steps_per_day
+            weather = 1 + 0.3 * np.sin(2 * np.pi * (start + k) / (7 * steps_per_day))  # weekly variation
+            daily = 1 + (0.2 * np.sin(phase) if steps_per_day > 1 else 0)  # daily cycle of the hourly data
+            noise = 1 + 0.1 * rng.standard_normal(map_shape, dtype=np.float32)
+            block[k] = pattern * noise * (weather * daily) + aircraft * noise
+        var[start:stop] = block
+
+    ds.close()
+    return filename
+
+
+# write the ON and the OFF file of a species. Both files get the same noise, so ON - OFF is only the aircraft part
+def generate_pair(name, **settings):
+    return [generate_species(name, switch=switch, **settings) for switch in ("ON", "OFF")]
+
+
+# write an emission file like AvEmFluxes.nc4: emissions per level (numbered 1, 2, ...) without a time dimension
+def generate_emissions(region="europe", lat_step=lat_res, lon_step=lon_res, n_levels=32, dtype=np.float32,
+                       compression=0):
+    lon, lat = grid(region, lat_step, lon_step)
+    os.makedirs(output_dir, exist_ok=True)
+    filename = os.path.join(output_dir, "AvEmFluxes.nc4")
+    ds = netcdf_dataset(filename, "w", format="NETCDF4")
+    ds.setncatts({"Title": "Synthetic aircraft emissions", "Conventions": "COARDS", "Format": "NetCDF-4"})
+    ds.createDimension("lev", n_levels)
+    ds.createDimension("lat", len(lat))
+    ds.createDimension("lon", len(lon))
+
+    var = ds.createVariable("lev", np.int32, ("lev",))
+    var.setncatts({"long_name": "GEOS-Chem levels", "units": "level", "positive": "up", "axis": "Z"})
+    var[:] = np.arange(1, n_levels + 1)
+    for name, values, long_name, units, axis in (("lat", lat, "Latitude", "degrees_north", "Y"),
+                                                 ("lon", lon, "Longitude", "degrees_east", "X")):
+        var = ds.createVariable(name, np.float32, (name,), fill_value=np.float32(np.nan))
+        var.setncatts({"long_name": long_name, "units": units, "axis": axis})
+        var[:] = values
+
+    # the levels of the emission file are the lowest levels of the model, with eta from the level table
+    eta = eta_levels()[:n_levels] if n_levels <= 72 else eta_levels(n_levels)
+    profile = aircraft_profile(eta).astype(np.float32)
+    routes = route_pattern(lon, lat) * (0.2 + horizontal_pattern(lon, lat))
+    rng = np.random.default_rng([len(lon), len(lat), n_levels])
+    for name, long_name in emissions.items():
+        var = ds.createVariable(name, dtype, ("lev", "lat", "lon"), fill_value=np.array(np.nan, dtype=dtype),
+                                zlib=compression > 0, complevel=max(compression, 1), chunksizes=(1, len(lat), len(lon)))
+        var.setncatts({"long_name": long_name, "units": "kg/m2/s"})
+        for k in range(n_levels):
+            # emissions are zero outside the routes, like in the real inventory
+            noise = rng.random(routes.shape, dtype=np.float32)
+            var[k] = np.where(noise > 0.3, routes * noise * profile[k] * emission_scale[name], 0)
+    ds.close()
+    return filename
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic data files in " + output_dir)
+    parser.add_argument("species", nargs="+", choices=list(species) + ["AvEmFluxes"])
+    parser.add_argument("--month", default="JAN", choices=list(months))
+    parser.add_argument("--region", default="europe", choices=list(regions))
+    parser.add_argument("--lat-res", type=float, default=lat_res, help="latitude step in degrees")
+    parser.add_argument("--lon-res", type=float, default=lon_res, help="longitude step in degrees")
+    parser.add_argument("--levels", type=int, default=None, help="number of levels (72, 32 for AvEmFluxes)")
+    parser.add_argument("--times", type=int, default=None, help="number of time steps (21 days or 72 hours)")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float64"])
+    parser.add_argument("--compression", type=int, default=0, help="zlib level, 0 for none (fastest)")
+    args = parser.parse_args()
+
+    lon, lat = grid(args.region, args.lat_res, args.lon_res)
+    for name in args.species:
+        if name == "AvEmFluxes":
+            n_levels = args.levels or 32
+            print("Writing AvEmFluxes ({:.2f} GB)...".format(file_size(name, lon, lat, n_levels, 0, args.dtype) / 1E9))
+            print("Written", generate_emissions(args.region, args.lat_res, args.lon_res, n_levels, args.dtype,
+                                                args.compression))
+            continue
+        n_times = args.times or (21 if species[name]["freq"] == "24h" else 72)
+        print("Writing {} ON and OFF ({:.2f} GB each)...".format(
+            name, file_size(name, lon, lat, args.levels or 72, n_times, args.dtype) / 1E9))
+        for filename in generate_pair(name, month=args.month, region=args.region, lat_step=args.lat_res,
+                                      lon_step=args.lon_res, n_levels=args.levels or 72, n_times=n_times,
+                                      dtype=args.dtype, compression=args.compression):
+            print("Written", filename)
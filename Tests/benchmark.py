@@ -0,0 +1,322 @@
+from collections import OrderedDict
+import matplotlib
+matplotlib.use("Agg")  # render off-screen, so the drawing time doesn't depend on a window
+from matplotlib import pyplot as plt
+import cartopy.crs as ccrs
+import xarray as xr
+import numpy as np
+import tracemalloc
+import statistics
+import json
+import time
+import sys
+import os
+
+"""
+Benchmarks of the steps of the analysis pipeline, with baselines that are kept in baseline_file:
+
+    altitude_conversion     eta/level <-> altitude conversions of Altitude_converter.py for all 72 levels
+    dataset_open            opening a data file and loading one variable
+    on_off_slicing          ON - OFF difference of the ground level for a day of hourly data
+    country_assignment      assigning every grid cell to a country (country_master.find_country_name)
+    country_aggregation     summarising the cell values per country (country_master.process_data)
+    spatial_statistics      global Moran's I, Geary's C and local Moran's I
+    choropleth_render       drawing the country map (country_master.plot)
+    animation_render        drawing animation frames as in master.animate_plot
+
+Every benchmark is run `repeat` times; the median time is reported. The peak memory is measured in a separate run with
+tracemalloc (memory allocated through Python, which includes numpy arrays but not the buffers of the NetCDF library).
+A benchmark fails if its time or peak memory is more than `tolerance` above the baseline.
+
+Usage (from the Tests folder):
+    python benchmark.py                 run all benchmarks and compare them with the baseline
+    python benchmark.py --update        run all benchmarks and save the results as the new baseline
+    python benchmark.py name [name ...] run only the given benchmarks
+The exit code is 1 if any benchmark is slower or uses more memory than allowed, or fails with an error.
+
+Baselines are machine-local: timings depend on the machine, so Tests/benchmark_baseline.json is not part of the
+repository. Create it once on the machine that runs the comparisons with --update (and again after a change that is
+meant to change the timings). It is only written with --update, never as a side effect of a comparison. Without a
+baseline, or for benchmarks that are missing from it, the results are reported with a warning and are not compared.
+
+Benchmarks that can't run in the installed environment are skipped with a message instead of failing the run: the
+country benchmarks need country_master.create_country_polygons, which doesn't work with shapely 2 (a Polygon has no
+.geoms there).
+"""
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+baseline_file = os.path.join(repo_dir, "Tests", "benchmark_baseline.json")
+
+tolerance = 0.25  # allowed relative increase of time and peak memory compared to the baseline
+
+on_filename = "../Data/PM25.1h.JAN.ON.nc4"
+off_filename = "../Data/PM25.1h.JAN.OFF.nc4"
+em_filename = "../Data/AvEmFluxes.nc4"
+
+benchmarks = OrderedDict()  # name: (setup function, folder, repeat)
+shared = {}  # results of expensive setup steps that several benchmarks need
+
+
+# raised by the setup of a benchmark that can't run in this environment
+class SkipBenchmark(Exception):
+    pass
+
+
+# register a benchmark. The decorated function does the setup (not timed) and returns the function that is timed.
+# It is called with the working directory set to the given folder of the repository, like the scripts themselves
+def benchmark(folder, repeat=5):
+    def register(setup):
+        benchmarks[setup.__name__] = (setup, folder, repeat)
+        return setup
+    return register
+
+
+# run a function with the working directory and import path set to a folder of the repository
+def in_folder(folder, function):
+    path = os.path.join(repo_dir, folder)
+    old_dir = os.getcwd()
+    os.chdir(path)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    try:
+        return function()
+    finally:
+        os.chdir(old_dir)
+
+
+def country_polygons():
+    if "countries" not in shared:
+        import country_master
+        import shapely
+        try:
+            shared["countries"] = country_master.create_country_polygons()
+        except AttributeError as error:  # shapely 2 returns Polygons where the code expects MultiPolygons
+            shared["countries"] = None
+            shared["countries_error"] = "country_master.create_country_polygons fails with shapely {}: {}".format(
+                shapely.__version__, error)
+    if shared["countries"] is None:
+        raise SkipBenchmark(shared["countries_error"])
+    return shared["countries"]
+
+
+# per-country lists of the emission and column BC values of the grid cells, in the format of
+# country_master.find_poll_em_data
+def country_raw_data():
+    if "raw_data" not in shared:
+        import country_master
+        countries = country_polygons()
+        DS = xr.open_dataset(em_filename)
+        emission = DS.BC.isel(lev=country_master.emission_levels).sum("lev").values
+        column = DS.BC.sum("lev").values
+        raw_data = {}
+        for i, lat in enumerate(DS.lat.values):
+            for j, lon in enumerate(DS.lon.values):
+                country = country_master.find_country_name(countries, lon, lat)
+                if country is not None:
+                    cell_data = raw_data.setdefault(country, [[], []])
+                    cell_data[0].append(float(emission[i, j]) * country_master.em_multiplier)
+                    cell_data[1].append(float(column[i, j]) * country_master.em_multiplier)
+        DS.close()
+        shared["raw_data"] = OrderedDict(sorted(raw_data.items()))
+    return shared["raw_data"]
+
+
+def processed_country_data():
+    if "processed" not in shared:
+        import country_master
+        countries = country_polygons()
+        processed, removed = country_master.process_data(countries, country_raw_data())
+        shared["processed"] = processed
+        shared["countries_with_data"] = OrderedDict((name, countries[name]) for name in processed)
+    return shared["processed"], shared["countries_with_data"]
+
+
+@benchmark("Master program")
+def altitude_conversion():
+    import Altitude_converter
+    etas = np.genfromtxt("Altitude_levels.txt", skip_header=3, usecols=(1,))
+    heights = np.linspace(0, 20, 72)
+
+    def run():
+        for eta, h, level in zip(etas, heights, range(1, 73)):
+            Altitude_converter.eta_to_altitude(eta)
+            Altitude_converter.altitude_to_eta(h)
+            Altitude_converter.levels_to_altitude(level)
+            Altitude_converter.altitude_to_levels(h)
+    return run
+
+
+@benchmark("Master program")
+def dataset_open():
+    def run():
+        with xr.open_dataset(on_filename) as DS:
+            DS.PM25.load()
+    return run
+
+
+@benchmark("Master program")
+def on_off_slicing():
+    DS_on = xr.open_dataset(on_filename)
+    DS_off = xr.open_dataset(off_filename)
+
+    def run():
+        delta = DS_on.PM25 - DS_off.PM25
+        if "lev" in delta.dims:
+            delta = delta.sel(lev=1, method='nearest')
+        return delta.isel(time=slice(0, 24)).values
+    return run
+
+
+@benchmark("Country Group", repeat=1)
+def country_assignment():
+    import country_master
+    countries = country_polygons()
+    with xr.open_dataset(em_filename) as DS:
+        lon_axis = DS.lon.values
+        lat_axis = DS.lat.values
+
+    def run():
+        return [country_master.find_country_name(countries, lon, lat) for lon in lon_axis for lat in lat_axis]
+    return run
+
+
+@benchmark("Country Group")
+def country_aggregation():
+    import country_master
+    countries = country_polygons()
+    raw_data = country_raw_data()
+    return lambda: country_master.process_data(countries, raw_data)
+
+
+@benchmark("Country Group")
+def spatial_statistics():
+    import country_master
+    processed, countries_with_data = processed_country_data()
+
+    def run():
+        country_master.morans_i_global(countries_with_data, processed)
+        country_master.gearys_c(countries_with_data, processed)
+        country_master.morans_i_local(countries_with_data, processed)
+    return run
+
+
+@benchmark("Country Group")
+def choropleth_render():
+    import country_master
+    countries = country_polygons()
+    processed, _ = processed_country_data()
+
+    def run():
+        fig = plt.figure(figsize=(12, 6))
+        country_master.plot(countries, processed, mapping=country_master.sqrt_mapping)
+        fig.canvas.draw()
+        plt.close(fig)
+    return run
+
+
+@benchmark("Master program")
+def animation_render():
+    from frame_interpolation import interpolated_frames
+    da = xr.open_dataset(on_filename).PM25
+    if "lev" in da.dims:
+        da = da.sel(lev=1, method='nearest')
+    sub_frames = 3
+    n_rendered = 12  # number of frames drawn per run
+
+    def run():
+        frame_data = interpolated_frames(lambda k: da[k, :, :].values, da.time.size, sub_frames)
+        fig = plt.figure(figsize=(12, 6))
+        ax = plt.axes(projection=ccrs.PlateCarree())
+        ax.coastlines(resolution='50m')
+        cax = da[0, :, :].plot(add_colorbar=True, cmap='coolwarm', vmin=0, vmax=1)
+        for frame in range(n_rendered):
+            cax.set_array(frame_data(frame).ravel())
+            fig.canvas.draw()
+        plt.close(fig)
+    return run
+
+
+# run a benchmark: median time in seconds over the repeats and peak traced memory in MB
+def measure(name):
+    setup, folder, repeat = benchmarks[name]
+    run = in_folder(folder, setup)
+    in_folder(folder, run)  # warm up (imports, caches of the libraries)
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        in_folder(folder, run)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    in_folder(folder, run)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"time": statistics.median(times), "memory": peak / 1E6}
+
+
+def load_baseline():
+    try:
+        with open(baseline_file) as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        return {}
+
+
+# compare a result with its baseline. Returns a list of descriptions of the regressions
+def regressions(result, baseline):
+    found = []
+    for key, unit in (("time", "s"), ("memory", "MB")):
+        if key in baseline and result[key] > baseline[key] * (1 + tolerance):
+            found.append("{} {:.3g} {} > {:.3g} {} + {:.0%}".format(key, result[key], unit, baseline[key], unit,
+                                                                   tolerance))
+    return found
+
+
+def run_benchmarks(names, update=False):
+    baseline = load_baseline()
+    failed = []
+    print("{:<22}{:>12}{:>12}{:>14}{:>14}".format("benchmark", "time [s]", "baseline", "memory [MB]", "baseline"))
+    for name in names:
+        try:
+            result = measure(name)
+        except SkipBenchmark as reason:
+            print("{:<22}SKIPPED: {}".format(name, reason))
+            continue
+        except Exception as error:  # a broken benchmark fails, but the others still run
+            failed.append(name)
+            print("{:<22}ERROR: {!r}".format(name, error))
+            continue
+        old = baseline.get(name, {})
+        print("{:<22}{:>12.4f}{:>12}{:>14.2f}{:>14}".format(
+            name, result["time"], "-" if "time" not in old else "{:.4f}".format(old["time"]), result["memory"],
+            "-" if "memory" not in old else "{:.2f}".format(old["memory"])))
+        problems = [] if update or not old else regressions(result, old)
+        if problems:
+            failed.append(name)
+            print("    REGRESSION: " + ", ".join(problems))
+        elif not update and not old:
+            print("    WARNING: no baseline on this machine, run with --update to add it")
+        if update:
+            baseline[name] = result
+
+    if update:
+        with open(baseline_file, "w") as outfile:
+            json.dump(baseline, outfile, indent=4)
+        print("\nBaseline written to " + baseline_file)
+
+    if failed:
+        print("\n{} benchmark(s) failed: {}".format(len(failed), ", ".join(failed)))
+    return not failed
+
+
+if __name__ == "__main__":
+    selected = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    for unknown in set(selected).difference(benchmarks):
+        sys.exit("Unknown benchmark " + unknown + ", choose from " + ", ".join(benchmarks))
+    update = "--update" in sys.argv
+    if not update and not os.path.exists(baseline_file):
+        print("WARNING: no baseline in " + baseline_file + ", the results are not compared. Create it on this "
+              "machine with python benchmark.py --update\n")
+    ok = run_benchmarks(selected or list(benchmarks), update=update)
+    sys.exit(0 if ok else 1)
@@ -1,6 +1,9 @@
 import xarray as xr
 import cartopy.crs as ccrs
 import matplotlib.pyplot as plt
+import sys
+sys.path.append("../Master program")
+from slice_stats import data_array_limits
 
 filename_off = "../Data/Aerosol.24h.JAN.OFF.nc4"
 filename_on = "../Data/Aerosol.24h.JAN.ON.nc4"
@@ -23,7 +26,9 @@ av_data = pm25_gd_on - pm25_gd_off
 
 # plot data
 #ax.pcolormesh(da_off.lon, da_off.lat, av_data, transform=proj)
-av_data.plot(add_colorbar=True, cmap='coolwarm', vmin=av_data.values.min(), vmax=av_data.values.max(),
+# colour limits of the ground level of ON - OFF, from the precomputed statistics of the files
+vmin, vmax = data_array_limits(da_on, da_off, level=1)
+av_data.plot(add_colorbar=True, cmap='coolwarm', vmin=vmin, vmax=vmax,
             cbar_kwargs={'extend': 'neither'})
 
 plt.show()
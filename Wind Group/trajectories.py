@@ -0,0 +1,216 @@
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from wind_cube import load_cube, open_cube
+
+"""
+Lagrangian particle advection through the MERRA2 wind fields. Particles are moved with the time-varying 3D winds
+(U, V and OMEGA) using fourth order Runge-Kutta steps. The wind at a particle position is found by trilinear
+interpolation in space (longitude, latitude, model level) and linear interpolation in time. All particles are handled
+as NumPy arrays, and large ensembles are split into blocks that are advected by separate processes.
+
+Particles can be advected forward in time (where do emissions at cruise altitude end up?) or backward in time (where
+did the air above a ground receptor come from?). The result is written as a compressed .npz file with one column per
+quantity (time, lon, lat, pressure, altitude), each with shape (output steps, particles).
+
+The vertical coordinate of the particles is pressure in hPa. Model levels are converted to pressure using the
+reference pressures in Altitude_levels.txt, so variations in surface pressure are not taken into account. Level
+index 0 in the wind files is assumed to be the lowest level (L = 1 in the level table).
+"""
+
+month = '01'
+days = ['11', '12', '13']
+
+level_file = '../Master program/Altitude_levels.txt'
+
+earth_radius = 6.371E6  # m
+
+time_step = 900  # s, negative values advect backwards in time
+output_every = 4  # number of time steps between two stored positions
+block_size = 50000  # number of particles per process
+processes = cpu_count()
+
+
+# open U, V and OMEGA at all levels for the given days as a memory-mapped wind cube (see wind_cube.py). Returns the
+# grid (lon, lat, time in seconds since the first time step, level pressures) and the wind arrays with shape
+# (time, lev, lat, lon)
+def load_winds(month, day_list):
+    return load_cube(month, day_list, with_omega=True)
+
+
+# altitude (km) belonging to a pressure (hPa), using the level table
+def pressure_to_altitude(p):
+    alt_dat = np.genfromtxt(level_file, skip_header=3, usecols=(2, 3))
+    order = np.argsort(alt_dat[:, 1])
+    return np.interp(p, alt_dat[order, 1], alt_dat[order, 0])
+
+
+# convert positions to fractional indices in the wind arrays
+def grid_index(winds, lon, lat, p):
+    lon_axis = winds["lon"]
+    lat_axis = winds["lat"]
+    x = (lon - lon_axis[0]) / (lon_axis[1] - lon_axis[0])
+    y = (lat - lat_axis[0]) / (lat_axis[1] - lat_axis[0])
+    # pressure decreases with level index, np.interp needs increasing sample points
+    pressure = winds["pressure"]
+    z = np.interp(p, pressure[::-1], np.arange(len(pressure))[::-1])
+    return x, y, z
+
+
+# trilinear interpolation of one 3D field (lev, lat, lon) at fractional indices. The eight corners of each grid box
+# are gathered from the flattened field, so there is no loop over the particles
+def trilinear(field, x, y, z):
+    nz, ny, nx = field.shape
+    x0 = np.clip(np.floor(x).astype(np.intp), 0, nx - 2)
+    y0 = np.clip(np.floor(y).astype(np.intp), 0, ny - 2)
+    z0 = np.clip(np.floor(z).astype(np.intp), 0, nz - 2)
+    fx = np.clip(x - x0, 0, 1)
+    fy = np.clip(y - y0, 0, 1)
+    fz = np.clip(z - z0, 0, 1)
+
+    flat = field.reshape(-1)
+    base = (z0 * ny + y0) * nx + x0
+    result = np.zeros(len(x), dtype=np.float64)
+    for dz, wz in ((0, 1 - fz), (1, fz)):
+        for dy, wy in ((0, 1 - fy), (1, fy)):
+            for dx, wx in ((0, 1 - fx), (1, fx)):
+                result += flat[base + (dz * ny + dy) * nx + dx] * (wz * wy * wx)
+    return result
+
+
+# wind at the particle positions at time t (s). Returns the rate of change of longitude and latitude (degrees per
+# second) and of pressure (hPa per second)
+def velocity(winds, t, lon, lat, p):
+    times = winds["time"]
+    ti = np.interp(t, times, np.arange(len(times)))
+    t0 = min(int(ti), len(times) - 2)
+    wt = ti - t0
+
+    x, y, z = grid_index(winds, lon, lat, p)
+    rates = []
+    for name in ("U", "V", "OMEGA"):
+        field = winds[name]
+        rates.append((1 - wt) * trilinear(field[t0], x, y, z) + wt * trilinear(field[t0 + 1], x, y, z))
+    u, v, omega = rates
+
+    dlon = np.degrees(u / (earth_radius * np.cos(np.radians(lat))))
+    dlat = np.degrees(v / earth_radius)
+    return dlon, dlat, omega / 100  # Pa/s to hPa/s
+
+
+# one fourth order Runge-Kutta step of size dt for all particles
+def rk4_step(winds, t, lon, lat, p, dt):
+    k1 = velocity(winds, t, lon, lat, p)
+    k2 = velocity(winds, t + dt / 2, lon + k1[0] * dt / 2, lat + k1[1] * dt / 2, p + k1[2] * dt / 2)
+    k3 = velocity(winds, t + dt / 2, lon + k2[0] * dt / 2, lat + k2[1] * dt / 2, p + k2[2] * dt / 2)
+    k4 = velocity(winds, t + dt, lon + k3[0] * dt, lat + k3[1] * dt, p + k3[2] * dt)
+
+    lon = lon + dt / 6 * (k1[0] + 2 * k2[0] + 2 * k3[0] + k4[0])
+    lat = lat + dt / 6 * (k1[1] + 2 * k2[1] + 2 * k3[1] + k4[1])
+    p = p + dt / 6 * (k1[2] + 2 * k2[2] + 2 * k3[2] + k4[2])
+    return lon, lat, p
+
+
+# advect one block of particles from t_start for a number of steps. Particles that leave the horizontal domain are
+# set to NaN and stay there, the pressure is kept between the lowest and highest model level
+def advect_block(winds, lon, lat, p, t_start, steps, dt=time_step, every=output_every):
+    lon = np.array(lon, dtype=np.float64)
+    lat = np.array(lat, dtype=np.float64)
+    p = np.array(p, dtype=np.float64)
+    pressure = winds["pressure"]
+
+    n_out = steps // every + 1
+    out = {name: np.full((n_out, len(lon)), np.nan, dtype=np.float32) for name in ("lon", "lat", "pressure")}
+    out["time"] = np.zeros(n_out, dtype=np.float64)
+
+    def store(i, t):
+        out["lon"][i] = lon
+        out["lat"][i] = lat
+        out["pressure"][i] = p
+        out["time"][i] = t
+
+    t = t_start
+    store(0, t)
+    for step in range(1, steps + 1):
+        active = ~np.isnan(lon)
+        new_lon, new_lat, new_p = rk4_step(winds, t, lon[active], lat[active], p[active], dt)
+        lon[active], lat[active] = new_lon, new_lat
+        p[active] = np.clip(new_p, pressure.min(), pressure.max())
+
+        outside = (lon < winds["lon"][0]) | (lon > winds["lon"][-1]) | (lat < winds["lat"][0]) | \
+                  (lat > winds["lat"][-1])
+        lon[outside] = lat[outside] = p[outside] = np.nan
+
+        t += dt
+        if step % every == 0:
+            store(step // every, t)
+    return out
+
+
+# wind data used by the worker processes. Each process opens the memory-mapped cube itself when it starts, so the
+# wind arrays are shared through the page cache instead of being copied to every process
+_worker_winds = None
+
+
+def _init_worker(winds):
+    global _worker_winds
+    _worker_winds = open_cube(winds["cube"]) if "cube" in winds else winds
+
+
+# what is sent to the worker processes: only the name of the cube if the winds are memory-mapped
+def _worker_args(winds):
+    return {"cube": winds["cube"]} if "cube" in winds else winds
+
+
+def _advect_worker(args):
+    return advect_block(_worker_winds, *args)
+
+
+# advect a (large) ensemble of particles, starting at positions lon, lat (degrees) and p (hPa) at t_start (seconds
+# since the first wind field). Use a negative dt to trace particles backwards in time. The particles are split in
+# blocks of block_size that are divided over the worker processes
+def advect(winds, lon, lat, p, t_start, steps, dt=time_step, every=output_every, n_processes=processes):
+    lon, lat, p = np.atleast_1d(lon), np.atleast_1d(lat), np.atleast_1d(p)
+    blocks = [(lon[i:i + block_size], lat[i:i + block_size], p[i:i + block_size], t_start, steps, dt, every)
+              for i in range(0, len(lon), block_size)]
+
+    if n_processes > 1 and len(blocks) > 1:
+        with Pool(min(n_processes, len(blocks)), initializer=_init_worker, initargs=(_worker_args(winds),)) as pool:
+            results = pool.map(_advect_worker, blocks)
+    else:
+        results = [advect_block(winds, *block) for block in blocks]
+
+    trajectories = {"time": results[0]["time"]}
+    for name in ("lon", "lat", "pressure"):
+        trajectories[name] = np.concatenate([result[name] for result in results], axis=1)
+    trajectories["altitude"] = pressure_to_altitude(trajectories["pressure"]).astype(np.float32)
+    return trajectories
+
+
+# write trajectories to a compressed file with one array per quantity
+def save_trajectories(filename, trajectories):
+    np.savez_compressed(filename, **trajectories)
+
+
+# read trajectories written by save_trajectories. Returns a dictionary with the same columns
+def load_trajectories(filename):
+    with np.load(filename) as data:
+        return {name: data[name] for name in data.files}
+
+
+if __name__ == "__main__":
+    print("Loading wind fields...")
+    winds = load_winds(month, days)
+
+    # release 100 000 particles at cruise altitude (around 250 hPa) spread over the domain
+    n = 100000
+    rng = np.random.default_rng(0)
+    start_lon = rng.uniform(-10, 30, n)
+    start_lat = rng.uniform(40, 60, n)
+    start_p = np.full(n, 250.0)
+
+    print("Advecting particles...")
+    steps = int((winds["time"][-1] - winds["time"][0]) / abs(time_step))
+    trajectories = advect(winds, start_lon, start_lat, start_p, 0, steps)
+
+    save_trajectories("trajectories.npz", trajectories)
+    print("Finished")
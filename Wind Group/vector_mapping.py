@@ -8,38 +8,184 @@ test = '../Data/wind/MERRA2.20050111.A3dyn.05x0625.EU.nc4'
 m = '01'
 d = '11'
 
+# days that are played one after another in the animated view
+days = ['11', '12', '13']
 
-def unpack_data(month, day, time):
-    dataset = netcdf_dataset('../Data/wind/' + month + '/MERRA2.2005' + month + day + '.A3dyn.05x0625.EU.nc4')
+# index of the model level that is shown (0 is the first level in the file)
+level = 0
+
+# number of arrows drawn per inch of axes, in both directions. The vectors are reduced to this density for the part of
+# the map that is currently visible, so zooming in shows more detail and zooming out does not clutter the map
+arrows_per_inch = 3
+
+# the way vectors are reduced when there are more grid cells than arrows: "thin" only keeps every n-th vector,
+# "average" takes the mean over blocks of n x n cells (smoother, but slightly slower when the zoom level changes)
+reduction = "average"
+
+fps = 5  # frames per second of the animation
+
+quiver_style = dict(units='xy', alpha=0.8, pivot='tail', scale=20, headwidth=2, width=0.04)
+
+
+# path to the dynamics file of a given day
+def wind_filename(month, day):
+    return '../Data/wind/' + month + '/MERRA2.2005' + month + day + '.A3dyn.05x0625.EU.nc4'
+
+
+def unpack_data(month, day, time, lev=0):
+    dataset = netcdf_dataset(wind_filename(month, day))
 
     # the 'lon' array is 1D with 129 entries. The 'lat' array is 1D with 81 entries.
     x = dataset.variables['lon'][:]
     y = dataset.variables['lat'][:]
     # the U and V array are both 4D. The first col is time, the second is lev, third and fourth are lat and lon.
-    # we take the first time and first lev entry, which returns both u and v as 2D.
-    u = dataset.variables['U'][time, 0, :, :]
-    v = dataset.variables['V'][time, 0, :, :]
+    # we take the given time and lev entry, which returns both u and v as 2D.
+    u = dataset.variables['U'][time, lev, :, :]
+    v = dataset.variables['V'][time, lev, :, :]
 
     # the quiver() function requires all arrays to be the same size
     # therefore we convert x and y into 2D arrays X and Y
     X, Y = np.meshgrid(x, y)
 
-    n = np.size(dataset.variables['U'][:, 0, 0, 0])
+    n = dataset.variables['U'].shape[0]
 
     return X, Y, u, v, n
 
 
+# read U and V at one level for all time steps of the given days in a single read per file. Returns the 1D coordinate
+# arrays, u and v with shape (time, lat, lon) and the wind speed for every frame. Missing values are stored as NaN so
+# the arrays can be averaged without masked array overhead
+def prefetch_frames(month, day_list, lev=0):
+    u_frames = []
+    v_frames = []
+    for day in day_list:
+        dataset = netcdf_dataset(wind_filename(month, day))
+        x = np.asarray(dataset.variables['lon'][:], dtype=np.float64)
+        y = np.asarray(dataset.variables['lat'][:], dtype=np.float64)
+        u_frames.append(np.ma.filled(dataset.variables['U'][:, lev, :, :].astype(np.float32), np.nan))
+        v_frames.append(np.ma.filled(dataset.variables['V'][:, lev, :, :].astype(np.float32), np.nan))
+        dataset.close()
+
+    u = np.concatenate(u_frames)
+    v = np.concatenate(v_frames)
+
+    return x, y, u, v, np.hypot(u, v)
+
+
+# reduce the last two axes (lat, lon) of an array by a factor k, either by taking every k-th value or by averaging
+# over blocks of k x k cells. Leading axes (e.g. time) are kept, so all frames are reduced at once
+def reduce_field(a, k, mode=reduction):
+    if k <= 1:
+        return a
+    if mode == "thin":
+        return a[..., ::k, ::k]
+
+    # pad the grid with NaN up to a multiple of k, so the edges of the map are not lost
+    ny, nx = a.shape[-2:]
+    pad = [(0, 0)] * (a.ndim - 2) + [(0, -ny % k), (0, -nx % k)]
+    a = np.pad(a.astype(np.float32), pad, constant_values=np.nan)
+    blocks = a.reshape(a.shape[:-2] + (a.shape[-2] // k, k, a.shape[-1] // k, k))
+    return np.nanmean(blocks, axis=(-3, -1))
+
+
+# same as reduce_field, but for a 1D coordinate axis
+def reduce_axis(c, k, mode=reduction):
+    if k <= 1:
+        return c
+    if mode == "thin":
+        return c[::k]
+    c = np.pad(c, (0, -len(c) % k), constant_values=np.nan)
+    return np.nanmean(c.reshape(-1, k), axis=1)
+
+
+# find the reduction factor needed to show at most arrows_per_inch arrows in the part of the grid that is visible in
+# the axes. Depends on the current zoom (axis limits) and the size of the axes on screen
+def lod_factor(ax, x, y):
+    x_min, x_max = sorted(ax.get_xlim())
+    y_min, y_max = sorted(ax.get_ylim())
+    nx = max(1, np.count_nonzero((x >= x_min) & (x <= x_max)))
+    ny = max(1, np.count_nonzero((y >= y_min) & (y <= y_max)))
+
+    bbox = ax.get_window_extent()
+    width = bbox.width / ax.figure.dpi  # size of the axes in inches
+    height = bbox.height / ax.figure.dpi
+
+    k = max(nx / max(width * arrows_per_inch, 1), ny / max(height * arrows_per_inch, 1))
+    return max(1, int(np.ceil(k)))
+
+
 def main():
     fig = plt.figure()
     ax = plt.axes(projection=ccrs.PlateCarree())
     ax.coastlines(resolution='50m')
 
-    x, y, u, v, n = unpack_data(m, d, 0)
+    x, y, u, v, n = unpack_data(m, d, 0, level)
+
+    k = lod_factor(ax, x[0], y[:, 0])
+    u = reduce_field(np.ma.filled(u, np.nan), k)
+    v = reduce_field(np.ma.filled(v, np.nan), k)
+    color_array = np.hypot(u, v)
+    ax.quiver(reduce_field(x, k), reduce_field(y, k), u, v, color_array, **quiver_style)
+
+    plt.show()
+
+
+# animated wind view. All frames are read once, and the Quiver artist is only created again when the level of detail
+# changes (zooming, resizing the window). Every other frame is drawn by updating the existing arrows with set_UVC
+def animate_wind(month=m, day_list=days, lev=level):
+    x, y, u, v, speed = prefetch_frames(month, day_list, lev)
+    n = u.shape[0]
+
+    fig = plt.figure(figsize=(12, 6))
+    ax = plt.axes(projection=ccrs.PlateCarree())
+    ax.coastlines(resolution='50m')
+    ax.set_xlim(x.min(), x.max())
+    ax.set_ylim(y.min(), y.max())
+
+    # reduced versions of the prefetched arrays, for every reduction factor that has been used so far
+    reduced = {}
+    # the current quiver, its reduction factor and the frame that is shown
+    state = {"quiver": None, "k": None, "frame": 0}
+
+    def get_reduced(k):
+        if k not in reduced:
+            X, Y = np.meshgrid(reduce_axis(x, k), reduce_axis(y, k))
+            u_k = reduce_field(u, k)
+            v_k = reduce_field(v, k)
+            reduced[k] = (X, Y, u_k, v_k, np.hypot(u_k, v_k))
+        return reduced[k]
+
+    # (re)create the quiver if the level of detail has changed since it was last drawn
+    def update_lod(*args):
+        k = lod_factor(ax, x, y)
+        if k == state["k"]:
+            return
+        X, Y, u_k, v_k, c_k = get_reduced(k)
+        if state["quiver"] is not None:
+            state["quiver"].remove()
+        frame = state["frame"]
+        state["quiver"] = ax.quiver(X, Y, u_k[frame], v_k[frame], c_k[frame], clim=(np.nanmin(speed),
+                                                                                    np.nanmax(speed)),
+                                    **quiver_style)
+        state["k"] = k
+
+    def animate(frame):
+        state["frame"] = frame
+        update_lod()
+        X, Y, u_k, v_k, c_k = reduced[state["k"]]
+        state["quiver"].set_UVC(u_k[frame], v_k[frame], c_k[frame])
+        ax.set_title("Frame " + str(frame + 1) + " of " + str(n))
+        return state["quiver"],
 
-    color_array = np.sqrt(v ** 2 + u ** 2)
-    ax.quiver(x, y, u, v, color_array, units='xy', alpha=0.8, pivot='tail', scale=20, headwidth=2, width=0.04)
+    update_lod()
+    ax.callbacks.connect('xlim_changed', update_lod)
+    ax.callbacks.connect('ylim_changed', update_lod)
+    fig.canvas.mpl_connect('resize_event', update_lod)
 
+    ani = animation.FuncAnimation(fig, animate, frames=n, interval=1000 / fps)
     plt.show()
+    return ani
 
 
-main()
+if __name__ == "__main__":
+    animate_wind()
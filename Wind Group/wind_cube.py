@@ -0,0 +1,152 @@
+import numpy as np
+from netCDF4 import Dataset as netcdf_dataset, num2date
+import json
+import os
+from vector_mapping import wind_filename
+
+"""
+Converts the per-day MERRA2 dynamics files into one memory-mapped cube per variable, with shape (time, lev, lat, lon)
+and type float32. The cubes are stored as .npy files together with a small JSON file describing the grid, so every
+level or time slice can afterwards be taken as a view of the file instead of opening and decoding a NetCDF file.
+
+Every set of days (and with or without OMEGA) gets its own cube directory, e.g. 01_11-13_omega for 11 to 13 January
+with OMEGA, so scripts that use different days of the same month don't overwrite each other's cube.
+
+Levels in the cube are ordered like in the wind files, level index 0 being model level L = 1 in Altitude_levels.txt.
+Use level_index() to find the level closest to an altitude in km.
+"""
+
+cube_dir = '../Data/wind/cube/'
+level_file = '../Master program/Altitude_levels.txt'
+
+month = '01'
+days = ['11', '12', '13']
+
+
+# name of the cube for the given days of a month, with or without OMEGA
+def cube_name(month, day_list, with_omega=False):
+    return '{}_{}-{}{}'.format(month, day_list[0], day_list[-1], '_omega' if with_omega else '')
+
+
+# directory in which a cube is stored
+def cube_path(name):
+    return cube_dir + name + '/'
+
+
+# write the cube for the given days. The files are read one by one and written into the memory-mapped output, so only
+# a single day is in memory at any time. OMEGA (vertical pressure velocity) is only added if with_omega is set
+def build_cube(month, day_list, with_omega=False):
+    variables = ['U', 'V'] + (['OMEGA'] if with_omega else [])
+    path = cube_path(cube_name(month, day_list, with_omega))
+    os.makedirs(path, exist_ok=True)
+
+    # read the grid and the number of time steps from the files, without reading any wind data
+    n_times = []
+    seconds = []
+    start = None
+    for day in day_list:
+        dataset = netcdf_dataset(wind_filename(month, day))
+        time = dataset.variables['time']
+        dates = num2date(time[:], time.units)
+        if start is None:
+            start = dates[0]
+            lon = np.asarray(dataset.variables['lon'][:], dtype=np.float64)
+            lat = np.asarray(dataset.variables['lat'][:], dtype=np.float64)
+            n_lev = dataset.variables['U'].shape[1]
+        seconds.extend([(date - start).total_seconds() for date in dates])
+        n_times.append(len(dates))
+        dataset.close()
+
+    shape = (sum(n_times), n_lev, len(lat), len(lon))
+    cubes = {name: np.lib.format.open_memmap(path + name + '.npy', mode='w+', dtype=np.float32, shape=shape)
+             for name in variables}
+
+    t = 0
+    for day, n in zip(day_list, n_times):
+        dataset = netcdf_dataset(wind_filename(month, day))
+        for name in variables:
+            cubes[name][t:t + n] = np.ma.filled(dataset.variables[name][:], 0)
+        dataset.close()
+        t += n
+
+    for cube in cubes.values():
+        cube.flush()
+
+    sources = [wind_filename(month, day) for day in day_list]
+    info = {"variables": variables, "shape": shape, "lon": lon.tolist(), "lat": lat.tolist(), "time": seconds,
+            "start": str(start), "sources": sources, "mtimes": [os.path.getmtime(source) for source in sources]}
+    with open(path + 'cube.json', 'w') as outfile:
+        json.dump(info, outfile, indent=4)
+
+
+# check whether a cube exists for the given days and is newer than its source files
+def cube_is_valid(month, day_list, with_omega=False):
+    try:
+        with open(cube_path(cube_name(month, day_list, with_omega)) + 'cube.json') as infile:
+            info = json.load(infile)
+    except FileNotFoundError:
+        return False
+
+    sources = [wind_filename(month, day) for day in day_list]
+    if info["sources"] != sources or (with_omega and "OMEGA" not in info["variables"]):
+        return False
+    return all(os.path.getmtime(source) == mtime for source, mtime in zip(sources, info["mtimes"]))
+
+
+# open a cube (by its name, see cube_name) read-only. Returns a dictionary with the name ("cube"), the grid ("lon",
+# "lat", "time" in seconds since the first time step, "pressure" and "altitude" of the levels) and one memory-mapped
+# array per variable
+def open_cube(name):
+    path = cube_path(name)
+    with open(path + 'cube.json') as infile:
+        info = json.load(infile)
+
+    cube = {"cube": name, "lon": np.array(info["lon"]), "lat": np.array(info["lat"]), "time": np.array(info["time"]),
+            "start": info["start"]}
+    for name in info["variables"]:
+        cube[name] = np.load(path + name + '.npy', mmap_mode='r')
+
+    n_lev = info["shape"][1]
+    cube["altitude"] = level_altitudes(n_lev)
+    cube["pressure"] = level_pressures(n_lev)
+    return cube
+
+
+# open the cube for the given days, building it first if it does not exist or is out of date
+def load_cube(month, day_list, with_omega=False):
+    if not cube_is_valid(month, day_list, with_omega):
+        print("Building wind cube...")
+        build_cube(month, day_list, with_omega)
+    return open_cube(cube_name(month, day_list, with_omega))
+
+
+# level table sorted from the ground upwards, with columns level number, eta, altitude (km) and pressure (hPa)
+def level_table():
+    alt_dat = np.genfromtxt(level_file, skip_header=3, usecols=(0, 1, 2, 3))
+    return alt_dat[np.argsort(alt_dat[:, 0])]
+
+
+# altitude (km) of the lowest n levels
+def level_altitudes(n=72):
+    return level_table()[:n, 2]
+
+
+# pressure (hPa) of the lowest n levels
+def level_pressures(n=72):
+    return level_table()[:n, 3]
+
+
+# index of the level closest to the altitude h (km)
+def level_index(h, n=72):
+    return int(np.argmin(np.abs(level_altitudes(n) - h)))
+
+
+# the 2D (lat, lon) field of a variable at a time index and altitude (km). This is a view of the memory-mapped file,
+# so nothing is read until the values are used
+def wind_slice(cube, name, time, altitude):
+    return cube[name][time, level_index(altitude, cube[name].shape[1])]
+
+
+if __name__ == "__main__":
+    build_cube(month, days, with_omega=True)
+    print("Finished")